@@ -3,50 +3,95 @@ import logging
 import os
 import boto3
 from botocore.exceptions import ClientError
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from botocore.config import Config
 import time
+import random
+from functools import lru_cache
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 region = os.environ.get('AWS_REGION')
+# The OriginalType tag is written by the start automation, so validating it is opt-in
+validate_original_type = os.environ.get('VALIDATE_ORIGINAL_TYPE') == '1'
 
-# Create a custom configuration for User Agent
+# Create a custom configuration for User Agent, connection reuse and retries
 custom_config = Config(
-    user_agent_extra='FlexibleInstanceStarter/1.0'
+    user_agent_extra='FlexibleInstanceStarter/1.0',
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=10,
+    retries={'mode': 'adaptive', 'total_max_attempts': 5}
 )
 
+# Clients are created on first use and reused across warm Lambda invocations
+@lru_cache(maxsize=None)
+def _get_ec2_client():
+    return boto3.client('ec2', region_name=region, config=custom_config)
+
+# In Lambda, build the client during the init phase, which runs before the first event
+if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    _get_ec2_client()
+
+@lru_cache(maxsize=512)
+def _is_valid_instance_type(instance_type: str) -> bool:
+    """
+    Validate if the given instance type is a valid EC2 instance type.
+    Results are cached so warm containers validate each type only once.
+    
+    Args:
+        instance_type (str): The instance type to validate
+        
+    Returns:
+        bool: True if the instance type is valid, False otherwise
+    """
+    try:
+        # Use describe_instance_types to check if the instance type exists
+        response = _get_ec2_client().describe_instance_types(
+            InstanceTypes=[instance_type]
+        )
+        return len(response['InstanceTypes']) > 0
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidInstanceType':
+            return False
+        raise
+
 class EC2InstanceManager:
     def __init__(self):
         self.region = region
-        self.ec2_client = boto3.client('ec2', region_name=region, config=custom_config)
-        self.ec2_resource = boto3.resource('ec2', region_name=region, config=custom_config)
+        self.ec2_client = _get_ec2_client()
 
     def _is_valid_instance_type(self, instance_type: str) -> bool:
+        """Validate if the given instance type is a valid EC2 instance type."""
+        return _is_valid_instance_type(instance_type)
+
+    def get_instance_states(self, instance_ids: List[str]) -> Dict[str, str]:
         """
-        Validate if the given instance type is a valid EC2 instance type.
-        
+        Get the current state of several instances with a single DescribeInstanceStatus call.
+
         Args:
-            instance_type (str): The instance type to validate
-            
+            instance_ids (List[str]): The IDs of the EC2 instances
+
         Returns:
-            bool: True if the instance type is valid, False otherwise
+            Dict[str, str]: Mapping of instance ID to state name
         """
-        try:
-            # Use describe_instance_types to check if the instance type exists
-            response = self.ec2_client.describe_instance_types(
-                InstanceTypes=[instance_type]
-            )
-            return len(response['InstanceTypes']) > 0
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'InvalidInstanceType':
-                return False
-            raise
+        response = self.ec2_client.describe_instance_status(
+            InstanceIds=instance_ids,
+            IncludeAllInstances=True
+        )
+        return {
+            status['InstanceId']: status['InstanceState']['Name']
+            for status in response['InstanceStatuses']
+        }
 
-    def wait_for_instance_stopped(self, instance_id: str, max_attempts: int = 30) -> tuple[bool, str]:
+    def wait_for_instance_stopped(self, instance_id: str, max_attempts: int = 12) -> tuple[bool, str]:
         """
         Wait for an instance to reach the 'stopped' state.
+
+        Polls with exponential backoff and jitter, capped at 30 seconds between checks,
+        so quick transitions are detected early without over-polling slow ones.
+        The default attempts keep the total wait within the Lambda timeout.
         
         Args:
             instance_id (str): The ID of the EC2 instance
@@ -55,31 +100,28 @@ class EC2InstanceManager:
         Returns:
             bool: True if instance reached stopped state, False otherwise
         """
-        instance = self.ec2_resource.Instance(instance_id)
         attempt = 0
         
         while attempt < max_attempts:
             attempt += 1
-            instance.reload()  # Get the latest instance state
-            current_state = instance.state['Name']
-            logger.info(f"Instance {instance_id} state check attempt {attempt}/{max_attempts}: {current_state}")
+            current_state = self.get_instance_states([instance_id]).get(instance_id)
+            # One structured line per poll; arguments are only formatted if INFO is enabled
+            logger.info(
+                "Instance %s state check attempt %d/%d: %s", instance_id, attempt, max_attempts, current_state,
+                extra={'instance_id': instance_id, 'attempt': attempt, 'state': current_state}
+            )
             
             if current_state == 'stopped':
-                logger.info(f"Instance {instance_id} has reached stopped state")
                 return True, current_state
-            elif current_state == 'terminated':
-                logger.info(f"Instance {instance_id} is terminated, no action needed")
-                return False, current_state
-            elif current_state in ['shutting-down', 'pending']:
-                logger.info(f"Instance {instance_id} is in invalid state for modification: {current_state}")
+            elif current_state in ['terminated', 'shutting-down', 'pending']:
+                # Terminated instances need no action, the others cannot be modified
                 return False, current_state
-            elif current_state == 'stopping':
-                logger.info(f"Instance {instance_id} is still stopping, waiting...")
-            else:
-                logger.warning(f"Instance {instance_id} in unexpected state: {current_state} {attempt} {max_attempts}")
+            elif current_state != 'stopping':
+                logger.warning("Instance %s in unexpected state: %s", instance_id, current_state)
                 
-            # Wait 10 seconds before next check
-            time.sleep(10)
+            # Back off exponentially before next check, there is none after the last attempt
+            if attempt < max_attempts:
+                time.sleep(min(2 ** attempt + random.uniform(0, 1), 30))
             
         logger.error(f"Timeout after {max_attempts} attempts waiting for instance {instance_id} to stop")
         return False, current_state
@@ -95,29 +137,29 @@ class EC2InstanceManager:
             Dict[str, str]: Dictionary containing instance details and changes made
         """
         try:
-            # Get the EC2 instance
-            instance = self.ec2_resource.Instance(instance_id)
+            # Get instance type and tags in one call
+            instance = self.ec2_client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
             
             # Get instance tags
-            tags = {tag['Key']: tag['Value'] for tag in instance.tags or []}
+            tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
             flexible = tags.get('Flexible', 'false').lower()
             
             # Log instance details and flexibility status
-            logger.info(f"Processing instance {instance_id}: {instance.instance_type}")
+            logger.info(f"Processing instance {instance_id}: {instance['InstanceType']}")
             logger.info(f"Flexible flag: {flexible}")
 
             # Check if instance is flexible and has original type
             if flexible == 'true':
                 if 'OriginalType' in tags:
                     original_type = tags['OriginalType']
-                    current_type = instance.instance_type
+                    current_type = instance['InstanceType']
                     
                     logger.info(f"Instance {instance_id} is flexible and has OriginalType tag")
                     logger.info(f"Original instance type: {original_type}")
                     logger.info(f"Current instance type: {current_type}")
                     
                     # Validate the original instance type
-                    if not self._is_valid_instance_type(original_type):
+                    if validate_original_type and not self._is_valid_instance_type(original_type):
                         logger.error(f"Invalid instance type in OriginalType tag: {original_type}")
                         return None
                     
@@ -132,12 +174,14 @@ class EC2InstanceManager:
                             return None
                             
                         # Update instance type to original
-                        instance.modify_attribute(
+                        self.ec2_client.modify_instance_attribute(
+                            InstanceId=instance_id,
                             InstanceType={'Value': original_type}
                         )
                         
                         # Remove OriginalType tag
-                        instance.delete_tags(
+                        self.ec2_client.delete_tags(
+                            Resources=[instance_id],
                             Tags=[{'Key': 'OriginalType'}]
                         )
                         logger.info(f"Successfully reset instance {instance_id} type and removed OriginalType tag")
@@ -161,12 +205,39 @@ class EC2InstanceManager:
             raise
 
 
+def reset_instance(instance_manager: EC2InstanceManager, instance_id: str) -> Optional[Dict[str, str]]:
+    """
+    Reset the instance type of the event's instance and build its result entry.
+
+    Errors are logged and reported as a failed entry.
+    """
+    try:
+        result = instance_manager.reset_instance_type(instance_id)
+    except Exception as e:
+        logger.error(f"Error resetting instance {instance_id}: {str(e)}")
+        return {
+            'instanceId': instance_id,
+            'status': 'failed',
+            'error': str(e)
+        }
+
+    if not result:
+        return None
+    return {
+        'instanceId': result.get('instance_id'),
+        'instanceType': result.get('instance_type'),
+        'newInstanceType': result.get('new_instance_type')
+    }
+
+
 def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
     """Lambda handler function"""
-    logger.info(f"Received event: {json.dumps(event)}")
+    # Serializing events is only worth it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received event: %s", json.dumps(event, separators=(',', ':')))
     
     try:
-        # Extract instance IDs from the failed StopInstances call
+        # Extract the instance ID from the state-change notification
         detail = event.get('detail', {})
         instance_id = detail.get('instance-id')
         
@@ -179,13 +250,9 @@ def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
         instance_manager = EC2InstanceManager()
                 
         # Reset Instance Type if it was changed by this automation
-        result = instance_manager.reset_instance_type(instance_id)
+        result = reset_instance(instance_manager, instance_id)
         if result:
-            results.append({
-                'instanceId': result.get('instance_id'),
-                'instanceType': result.get('instance_type'),
-                'newInstanceType': result.get('new_instance_type')
-            })
+            results.append(result)
 
         return {
             'statusCode': 200,
@@ -1,95 +1,461 @@
 import json
 import logging
 import os
+import time
+import tempfile
+import heapq
+import threading
+from functools import lru_cache, cached_property
+from operator import itemgetter
 import boto3
-import ast
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from botocore.config import Config
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-# Create a custom configuration for User Agent
+# Create a custom configuration for User Agent, connection reuse and retries
 custom_config = Config(
-    user_agent_extra='FlexibleInstanceStarter/1.0'
+    user_agent_extra='FlexibleInstanceStarter/1.0',
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=10,
+    retries={'mode': 'adaptive', 'total_max_attempts': 5}
 )
 
+# Pricing lookups for individual instance types run concurrently, so the client
+# needs enough pooled connections for every worker thread. The worker count is
+# kept low to stay under the Pricing API request rate limits.
+PRICING_MAX_WORKERS = 8
+pricing_config = custom_config.merge(Config(
+    max_pool_connections=32
+))
+# Caps the concurrent GetProducts calls of the whole process, whichever thread makes them
+_pricing_semaphore = threading.BoundedSemaphore(PRICING_MAX_WORKERS)
+
+# Pricing API filters selecting shared tenancy Linux on-demand prices, without pre-installed software
+PRICING_FILTERS = (
+    {'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'},
+    {'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': 'Shared'},
+    {'Type': 'TERM_MATCH', 'Field': 'preInstalledSw', 'Value': 'NA'},
+    {'Type': 'TERM_MATCH', 'Field': 'capacitystatus', 'Value': 'Used'}
+)
+
+# On-disk cache for instance type and pricing lookups, which change rarely.
+# In Lambda, CACHE_DIR points at /tmp so entries survive across warm invocations.
+CACHE_DIR = os.path.expanduser(os.environ.get('CACHE_DIR', '~/.cache/flex-starter'))
+CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Maximum number of instance types accepted by a single DescribeInstanceTypes call
+DESCRIBE_INSTANCE_TYPES_BATCH_SIZE = 100
+
+# Maximum number of compatible instance types tried, cheapest first
+MAX_CANDIDATES = int(os.environ.get('MAX_CANDIDATES', 10))
+
+# Instance families with GPUs or other accelerators, which are never swapped for another type
+ACCELERATED_INSTANCE_FAMILIES = ('g', 'p', 'f', 'inf', 'trn')
+
+# Order compatible instance types by on-demand price, or by vCPU and memory without pricing them
+SORT_BY_PRICE = os.environ.get('SORT_BY_PRICE', '1') == '1'
+
+# Instance type specifications per region, loaded once per process
+_instance_type_catalogs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_instance_type_catalogs_lock = threading.Lock()
+
+# On-demand prices per region, loaded once per process
+_region_price_maps: Dict[str, Dict[str, float]] = {}
+_region_price_maps_lock = threading.Lock()
+
+# Instance types matching a set of instance requirements, keyed by region, architecture and requirements,
+# with the time they were fetched. Entries expire after CACHE_TTL_SECONDS so newly launched types show up
+INSTANCE_REQUIREMENT_MATCHES_MAX_ENTRIES = 1024
+_instance_requirement_matches: Dict[str, Tuple[float, List[str]]] = {}
+_instance_requirement_matches_lock = threading.Lock()
+
+# Flexible configurations read from SSM Parameter Store, reused for a minute per process
+FLEXIBLE_CONFIGURATION_TTL_SECONDS = 60
+_flexible_configurations: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+# S3 bucket holding the daily refreshed price catalog, one <region>.json object per region
+PRICE_CATALOG_BUCKET = os.environ.get('PRICE_CATALOG_BUCKET_NAME')
+# Older catalogs mean the refresh keeps failing, prices then come from the Pricing API
+PRICE_CATALOG_MAX_AGE_SECONDS = 3 * 24 * 60 * 60
+
+
+def _disk_cache_get(key: str, ttl: int = CACHE_TTL_SECONDS) -> Any:
+    """Return the value cached on disk under key, or None if missing or older than ttl seconds."""
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _disk_cache_put(key: str, value: Any) -> None:
+    """Cache a JSON serializable value on disk under key. Failures are logged and ignored."""
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        with tempfile.NamedTemporaryFile('w', dir=CACHE_DIR, suffix='.tmp', delete=False) as cache_file:
+            tmp_path = cache_file.name
+            json.dump(value, cache_file)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, f"{key}.json"))
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug(f"Unable to write cache entry {key}: {e}")
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _extract_ondemand_price(price_data: Dict[str, Any]) -> Optional[float]:
+    """Return the first USD price per unit found in the OnDemand terms of a price list entry."""
+    for term in price_data.get('terms', {}).get('OnDemand', {}).values():
+        for dimension in term.get('priceDimensions', {}).values():
+            usd = dimension.get('pricePerUnit', {}).get('USD')
+            if usd is not None:
+                return float(usd)
+    return None
+
+
+def _smallest(n: Optional[int], iterable, key) -> List[Any]:
+    """Return the n smallest items of iterable by key, or all of them sorted if n is None."""
+    if n is None:
+        return sorted(iterable, key=key)
+    return heapq.nsmallest(n, iterable, key=key)
+
+
+@lru_cache(maxsize=None)
+def load_config(config_path: str) -> Dict[str, Any]:
+    """Parse the local configuration file once per process."""
+    with open(config_path) as json_data:
+        return json.load(json_data)
+
+
+# Clients are created on first use and reused across warm Lambda invocations
+@lru_cache(maxsize=None)
+def get_ec2_client(region: str):
+    return boto3.client('ec2', region_name=region, config=custom_config)
+
+
+@lru_cache(maxsize=None)
+def get_ssm_client(region: str):
+    return boto3.client('ssm', region_name=region, config=custom_config)
+
+
+@lru_cache(maxsize=None)
+def get_pricing_client():
+    # Pricing API is only available in us-east-1, one client serves every region
+    return boto3.client('pricing', region_name='us-east-1', config=pricing_config)
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client('s3', config=custom_config)
+
+
+@lru_cache(maxsize=4096)
+def _get_ondemand_price_cached(region: str, instance_type: str) -> float:
+    """
+    Get the on-demand price for a Linux instance of the given type in a region.
+
+    Results are memoized per process, so warm Lambda containers price each type once.
+    Failures raise instead of returning a sentinel so that they are not memoized.
+    """
+    cache_key = f"price-{region}-{instance_type}"
+    price = _disk_cache_get(cache_key)
+    if price is not None:
+        return price
+
+    filters = [
+        *PRICING_FILTERS,
+        {'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': instance_type},
+        {'Type': 'TERM_MATCH', 'Field': 'regionCode', 'Value': region}
+    ]
+
+    # Only the first matching product is read, so only one is transferred
+    with _pricing_semaphore:
+        response = get_pricing_client().get_products(
+            ServiceCode='AmazonEC2',
+            Filters=filters,
+            FormatVersion='aws_v1',
+            MaxResults=1
+        )
+
+    if not response['PriceList']:
+        raise LookupError(f"No on-demand price found for {instance_type} in {region}")
+
+    price_data = json.loads(response['PriceList'][0])  # Price list entries are JSON documents
+    # Get the first price dimension from the first term
+    price = _extract_ondemand_price(price_data)
+    if price is None:
+        raise LookupError(f"No on-demand price found for {instance_type} in {region}")
+    _disk_cache_put(cache_key, price)
+    return price
+
+
+def fetch_region_price_map(region: str) -> Dict[str, float]:
+    """
+    Fetch the on-demand Linux price of every instance type in a region from the Pricing API.
+
+    Args:
+        region: The region code, e.g. eu-central-1
+
+    Returns:
+        Dict[str, float]: Mapping of instance type to hourly on-demand price in USD
+    """
+    filters = [
+        *PRICING_FILTERS,
+        {'Type': 'TERM_MATCH', 'Field': 'regionCode', 'Value': region}
+    ]
+
+    price_map = {}
+    paginator = get_pricing_client().get_paginator('get_products')
+    for page in paginator.paginate(ServiceCode='AmazonEC2', Filters=filters):
+        for price_str in page['PriceList']:
+            price_data = json.loads(price_str)
+            instance_type = price_data['product']['attributes'].get('instanceType')
+            price = _extract_ondemand_price(price_data)
+            if instance_type and price is not None:
+                price_map[instance_type] = price
+
+    return price_map
+
 
 class EC2InstanceManager:
     def __init__(self, region, config_path):
         self.region = region
-        self.ec2_client = boto3.client('ec2', region_name=region, config=custom_config)
-        self.ec2_resource = boto3.resource('ec2', region_name=region, config=custom_config)
-        self.pricing_client = boto3.client('pricing', region_name='us-east-1')  # Pricing API is only available in us-east-1
-        self.ssm_client = boto3.client('ssm', region_name=region)
-        self._price_cache = {}  # In-memory cache for instance type prices
-
-        with open(config_path) as json_data:
-            self.current_config = json.load(json_data)
+        self.ec2_client = get_ec2_client(region)
+        self.current_config = load_config(config_path)
+
+    # SSM is only needed when the instance has to fall back to another type,
+    # so its client is not created on the common path
+    @cached_property
+    def ssm_client(self):
+        return get_ssm_client(self.region)
     
-    def get_instance_details(self, instance_id: str) -> Dict[str, Any]:
-        """Get the current instance details including vCPU and Memory."""
-        instance = self.ec2_resource.Instance(instance_id)
-        return self.get_instance_type_details(instance.instance_type, instance.tags or [])
-
-    def get_instance_type_details(self, instance_type: str, tags: List[Dict[str, str]]) -> Dict[str, Any]:
-        """Get instance type details including vCPU, Memory and on-demand price."""
-        instance_type_info = self.ec2_client.describe_instance_types(
-            InstanceTypes=[instance_type]
-        )['InstanceTypes'][0]
-        
-        price = self.get_ondemand_price(instance_type)
-        
+    def _describe(self, instance_id: str) -> Dict[str, Any]:
+        """Describe an instance with a single DescribeInstances call."""
+        return self.ec2_client.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+
+    def describe_instances(self, instance_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Describe several instances with a single DescribeInstances call.
+
+        Args:
+            instance_ids: The IDs of the EC2 instances
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Mapping of instance ID to its DescribeInstances entry,
+            empty if the call fails so that instances are described individually instead
+        """
+        # Without instance IDs, DescribeInstances would return every instance in the region
+        if not instance_ids:
+            return {}
+
+        try:
+            response = self.ec2_client.describe_instances(InstanceIds=instance_ids)
+        except ClientError as e:
+            logger.error(f"Error describing instances {instance_ids}: {e}")
+            return {}
+
         return {
+            instance['InstanceId']: instance
+            for reservation in response['Reservations']
+            for instance in reservation['Instances']
+        }
+
+    def get_instance_details(self, instance: Dict[str, Any]) -> Dict[str, Any]:
+        """Get the instance type details including vCPU and Memory of an already described instance."""
+        return self.get_instance_type_details(instance['InstanceType'], instance.get('Tags', []))
+
+    def get_instance_type_details(self, instance_type: str, tags: List[Dict[str, str]], include_price: bool = False) -> Dict[str, Any]:
+        """Get instance type details including vCPU, Memory and, if include_price is set, on-demand price."""
+        instance_type_info = self.describe_types_bulk([instance_type])[instance_type]
+        
+        details = {
             'instance_type': instance_type,
             'tags': tags,
             'instance_type_info': instance_type_info,
             'vcpu': instance_type_info['VCpuInfo']['DefaultVCpus'],
-            'memory_mib': instance_type_info['MemoryInfo']['SizeInMiB'],
-            'ondemand_price': price
+            'memory_mib': instance_type_info['MemoryInfo']['SizeInMiB']
         }
+
+        # Pricing is a separate API call that the start workflow does not need
+        if include_price:
+            details['ondemand_price'] = self.get_ondemand_price(instance_type)
+
+        return details
         
-    def get_ondemand_price(self, instance_type: str) -> float:
-        """Get the on-demand price for a Linux instance of the given type."""
-        # Check cache first
-        if instance_type in self._price_cache:
-            return self._price_cache[instance_type]
+    def describe_types_bulk(self, instance_types: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Describe several instance types with as few DescribeInstanceTypes calls as possible.
 
-        try:
-            filters = [
-                {'Type': 'TERM_MATCH', 'Field': 'operation', 'Value': 'RunInstances'},
-                {'Type': 'TERM_MATCH', 'Field': 'instanceType', 'Value': instance_type},
-                {'Type': 'TERM_MATCH', 'Field': 'regionCode', 'Value': self.region},
-                {'Type': 'TERM_MATCH', 'Field': 'tenancy', 'Value': 'Shared'},
-                {'Type': 'TERM_MATCH', 'Field': 'preInstalledSw', 'Value': 'NA'},
-                {'Type': 'TERM_MATCH', 'Field': 'capacitystatus', 'Value': 'Used'}
-            ]
-            
-            response = self.pricing_client.get_products(
-                ServiceCode='AmazonEC2',
-                Filters=filters
+        Entries are served from the region's instance type catalog once it is loaded; other
+        types are requested in chunks of up to 100, the maximum the API accepts per call.
+        The catalog is never loaded here, so the start path only describes the types it needs.
+
+        Args:
+            instance_types: The instance types to describe
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Mapping of instance type to its DescribeInstanceTypes entry
+        """
+        catalog = _instance_type_catalogs.get(self.region, {})
+        described = {instance_type: catalog[instance_type] for instance_type in instance_types if instance_type in catalog}
+        missing_types = [instance_type for instance_type in instance_types if instance_type not in described]
+
+        for i in range(0, len(missing_types), DESCRIBE_INSTANCE_TYPES_BATCH_SIZE):
+            response = self.ec2_client.describe_instance_types(
+                InstanceTypes=missing_types[i:i + DESCRIBE_INSTANCE_TYPES_BATCH_SIZE]
             )
+            for instance_type_info in response['InstanceTypes']:
+                described[instance_type_info['InstanceType']] = instance_type_info
 
-            for price_str in response['PriceList']:
-                price_data = ast.literal_eval(price_str)  # Convert string to dict
-                terms = price_data['terms']['OnDemand']
-                # Get the first price dimension from the first term
-                term_id = list(terms.keys())[0]
-                price_dimensions = terms[term_id]['priceDimensions']
-                dimension_id = list(price_dimensions.keys())[0]
-                price = float(price_dimensions[dimension_id]['pricePerUnit']['USD'])
-                # Cache the price before returning
-                self._price_cache[instance_type] = price
-                return price
-
-            logger.error(f"Error getting price for {instance_type}")  
-            return float('inf')  # Return infinity if no price found
-            
+        # Types missing from a loaded catalog are added to it, concurrent workers share the catalog
+        if missing_types and catalog:
+            with _instance_type_catalogs_lock:
+                catalog.update((instance_type, described[instance_type]) for instance_type in missing_types if instance_type in described)
+
+        return {instance_type: described[instance_type] for instance_type in instance_types if instance_type in described}
+
+    def load_instance_type_catalog(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the specifications of every instance type offered in the region.
+
+        The catalog is fetched once per process with the DescribeInstanceTypes paginator
+        and cached on disk, so later lookups are dictionary reads.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Mapping of instance type to its DescribeInstanceTypes entry
+        """
+        if self.region in _instance_type_catalogs:
+            return _instance_type_catalogs[self.region]
+
+        # Concurrent start workers wait for the first one to load the catalog
+        with _instance_type_catalogs_lock:
+            if self.region in _instance_type_catalogs:
+                return _instance_type_catalogs[self.region]
+
+            cache_key = f"instance-types-{self.region}"
+            catalog = _disk_cache_get(cache_key)
+            if not catalog:
+                catalog = {}
+                try:
+                    paginator = self.ec2_client.get_paginator('describe_instance_types')
+                    for page in paginator.paginate():
+                        for instance_type_info in page['InstanceTypes']:
+                            catalog[instance_type_info['InstanceType']] = instance_type_info
+                    logger.info(f"Loaded {len(catalog)} instance types for {self.region}")
+                    if catalog:
+                        _disk_cache_put(cache_key, catalog)
+                except ClientError as e:
+                    # Lookups fall back to describing individual instance types
+                    logger.error(f"Error loading instance type catalog for {self.region}: {e}")
+                    return catalog
+
+            _instance_type_catalogs[self.region] = catalog
+            return catalog
+
+    def get_ondemand_price(self, instance_type: str) -> Optional[float]:
+        """Get the on-demand price for a Linux instance of the given type, or None if it cannot be determined."""
+        try:
+            return _get_ondemand_price_cached(self.region, instance_type)
         except Exception as e:
             logger.error(f"Error getting price for {instance_type}: {e}")
-            return float('inf')  # Return infinity if there's an error
+            return None
+
+    def load_region_prices(self) -> Dict[str, float]:
+        """
+        Load the on-demand Linux price of every instance type in the region.
+
+        The map is read from the price catalog bucket when one is configured, otherwise a
+        single paginated GetProducts query replaces one round-trip per instance type.
+        It is loaded once per process, cached on disk and reused for subsequent lookups.
+
+        Returns:
+            Dict[str, float]: Mapping of instance type to hourly on-demand price in USD
+        """
+        if self.region in _region_price_maps:
+            return _region_price_maps[self.region]
+
+        # Concurrent start workers wait for the first one to load the map
+        with _region_price_maps_lock:
+            if self.region in _region_price_maps:
+                return _region_price_maps[self.region]
+
+            cache_key = f"prices-{self.region}"
+            price_map = _disk_cache_get(cache_key)
+            if not price_map:
+                price_map = self._load_price_catalog_from_s3()
+                if not price_map:
+                    try:
+                        price_map = fetch_region_price_map(self.region)
+                        logger.info(f"Loaded on-demand prices for {len(price_map)} instance types in {self.region}")
+                    except Exception as e:
+                        # Prices are looked up per instance type instead, retry the bulk load next time
+                        logger.error(f"Error loading on-demand prices for {self.region}: {e}")
+                        return {}
+
+                # Only freshly loaded maps are written, rewriting a cached one would reset its ttl
+                if price_map:
+                    _disk_cache_put(cache_key, price_map)
+            # An empty map is not kept either, the next call loads it again
+            if price_map:
+                _region_price_maps[self.region] = price_map
+            return price_map
+
+    def _load_price_catalog_from_s3(self) -> Optional[Dict[str, float]]:
+        """Read the region price map published by the price catalog refresh function, if configured and not older than PRICE_CATALOG_MAX_AGE_SECONDS."""
+        if not PRICE_CATALOG_BUCKET:
+            return None
+
+        try:
+            response = get_s3_client().get_object(Bucket=PRICE_CATALOG_BUCKET, Key=f"{self.region}.json")
+            age = time.time() - response['LastModified'].timestamp()
+            if age > PRICE_CATALOG_MAX_AGE_SECONDS:
+                logger.warning(f"Ignoring price catalog for {self.region} in s3://{PRICE_CATALOG_BUCKET}, last refreshed {age / 3600:.0f} hours ago")
+                return None
+            price_map = json.loads(response['Body'].read())
+            logger.info(f"Loaded on-demand prices for {len(price_map)} instance types from s3://{PRICE_CATALOG_BUCKET}")
+            return price_map
+        except Exception as e:
+            logger.warning(f"Unable to read price catalog for {self.region} from s3://{PRICE_CATALOG_BUCKET}: {e}")
+            return None
+
+    def get_ondemand_prices(self, instance_types: List[str]) -> Dict[str, Optional[float]]:
+        """
+        Get the on-demand price of several instance types.
+
+        Prices come from the region-wide price map. Types missing from the map are
+        looked up individually, concurrently, since each lookup is an independent API call.
+
+        Args:
+            instance_types: The instance types to price
+
+        Returns:
+            Dict[str, Optional[float]]: Mapping of instance type to on-demand price, None if unknown
+        """
+        price_map = self.load_region_prices()
+        prices = {instance_type: price_map[instance_type] for instance_type in instance_types if instance_type in price_map}
+
+        missing_types = [instance_type for instance_type in instance_types if instance_type not in prices]
+        if missing_types:
+            logger.info(f"Looking up on-demand prices individually for {len(missing_types)} instance types")
+            # Lookups of concurrent callers share _pricing_semaphore, so the Pricing API
+            # never sees more than PRICING_MAX_WORKERS requests from this process
+            with ThreadPoolExecutor(max_workers=PRICING_MAX_WORKERS) as executor:
+                prices.update(zip(missing_types, executor.map(self.get_ondemand_price, missing_types)))
+
+        return prices
         
     def get_flexible_configuration(self, parameter_arn):
         """
@@ -97,6 +463,7 @@ class EC2InstanceManager:
         1. Try using the provided parameter_arn if available
         2. If that fails, try using '/flexible-instance-starter/default'
         3. If both fail, use self.current_config
+        Parameters are cached per process for FLEXIBLE_CONFIGURATION_TTL_SECONDS.
         
         Args:
             parameter_arn: The ARN of the SSM parameter to retrieve
@@ -107,18 +474,31 @@ class EC2InstanceManager:
         def try_get_parameter(param_name):
             if not param_name:
                 return None
+
+            cached = _flexible_configurations.get(param_name)
+            if cached and time.time() - cached[0] < FLEXIBLE_CONFIGURATION_TTL_SECONDS:
+                return cached[1]
                 
             try:
                 response = self.ssm_client.get_parameter(Name=param_name)
                 parameter_value = response['Parameter']['Value']
-                return json.loads(parameter_value)
+                config = json.loads(parameter_value)
             except json.JSONDecodeError as e:
                 logger.error(f"Parameter {param_name} contains invalid JSON: {e}")
                 return None
+            except ClientError as e:
+                logger.error(f"Error retrieving parameter {param_name}: {e}")
+                if e.response['Error']['Code'] != 'ParameterNotFound':
+                    return None
+                # A missing parameter is cached too, the default parameter is optional
+                config = None
             except Exception as e:
                 logger.error(f"Error retrieving parameter {param_name}: {e}")
                 return None
 
+            _flexible_configurations[param_name] = (time.time(), config)
+            return config
+
         # First try with provided parameter_arn
         if parameter_arn:
             config = try_get_parameter(parameter_arn)
@@ -137,8 +517,10 @@ class EC2InstanceManager:
         logger.info(f"Failed to get configuration from {default_param}, using local config")
         return self.current_config
             
-    def get_compatible_instance_types(self, instance_details: Dict[str, Any]) -> List[str]:
-        """Get compatible instance types based on original instance properties and requirements, sorted by on-demand price."""
+    def get_compatible_instance_types(self, instance_details: Dict[str, Any], availability_zone: Optional[str] = None,
+                                      max_candidates: Optional[int] = MAX_CANDIDATES) -> List[str]:
+        """Get the max_candidates (all if None) cheapest compatible instance types other than the original one, based on original instance properties and requirements, sorted by on-demand price (or by vCPU and memory if SORT_BY_PRICE is disabled).
+        If availability_zone is given, types not offered there are dropped before the candidates are selected."""
 
         vcpu = instance_details['vcpu']
         memory_mib = instance_details['memory_mib']
@@ -146,7 +528,7 @@ class EC2InstanceManager:
         original_instance_type=instance_details['instance_type']
         tags=instance_details['tags']
 
-        if original_instance_type.startswith('g') or original_instance_type.startswith('p') or original_instance_type.startswith('f') or original_instance_type.startswith('inf') or original_instance_type.startswith('trn'):
+        if original_instance_type.startswith(ACCELERATED_INSTANCE_FAMILIES):
             return []
 
         original_architecture = instance_type_info['ProcessorInfo']['SupportedArchitectures'][0]
@@ -190,63 +572,128 @@ class EC2InstanceManager:
                     'Min': instance_type_info.get('InstanceStorageInfo', {}).get('TotalSizeInGB', 0) * (100 - localStorageBuffer) / 100, 
                 }
 
-            response = self.ec2_client.get_instance_types_from_instance_requirements(
-                ArchitectureTypes=[original_architecture],
-                VirtualizationTypes=['hvm'],
-                InstanceRequirements=instance_requirements
-                #MaxResults=0  # Adjust as needed
-            )
+            # Instances of the same size share their requirements, so matches are reused
+            requirements_key = json.dumps([self.region, original_architecture, instance_requirements], sort_keys=True)
+            cached = _instance_requirement_matches.get(requirements_key)
+            if cached and time.time() - cached[0] < CACHE_TTL_SECONDS:
+                matching_types = cached[1]
+            else:
+                response = self.ec2_client.get_instance_types_from_instance_requirements(
+                    ArchitectureTypes=[original_architecture],
+                    VirtualizationTypes=['hvm'],
+                    InstanceRequirements=instance_requirements
+                    #MaxResults=0  # Adjust as needed
+                )
+                matching_types = [instance['InstanceType'] for instance in response['InstanceTypes']]
+                with _instance_requirement_matches_lock:
+                    _instance_requirement_matches.pop(requirements_key, None)
+                    # The oldest entries are evicted first
+                    while len(_instance_requirement_matches) >= INSTANCE_REQUIREMENT_MATCHES_MAX_ENTRIES:
+                        del _instance_requirement_matches[next(iter(_instance_requirement_matches))]
+                    _instance_requirement_matches[requirements_key] = (time.time(), matching_types)
             
+            # The original type was already tried, so it is not priced or returned
+            candidate_types = [
+                instance_type for instance_type in matching_types
+                if instance_type != original_instance_type
+                and (is_flex or is_burstable or not is_flex and '-flex' not in instance_type)
+            ]
+
+            # Skip instance types that are not offered at all in the instance's Availability Zone,
+            # before truncating so that offered types further down the list can take their place
+            if availability_zone:
+                candidate_types = self.filter_offered_instance_types(candidate_types, availability_zone)
+
+            if not SORT_BY_PRICE:
+                # Smallest instance types first, their specifications come from the catalog
+                specs = self.describe_types_bulk(candidate_types)
+                sorted_types = _smallest(
+                    max_candidates, specs.values(),
+                    key=lambda x: (x['VCpuInfo']['DefaultVCpus'], x['MemoryInfo']['SizeInMiB'])
+                )
+                return [instance_type_info['InstanceType'] for instance_type_info in sorted_types]
+
             # Get instance types with their prices
+            prices = self.get_ondemand_prices(candidate_types)
             instance_types_with_prices = []
-            for instance in response['InstanceTypes']:
-                instance_type = instance['InstanceType']
-                if is_flex or is_burstable or not is_flex and '-flex' not in instance_type:
-                    price = self.get_ondemand_price(instance_type)
-                    instance_types_with_prices.append((instance_type, price))
-                    
+            for instance_type in candidate_types:
+                if prices[instance_type] is None:
+                    # Don't spend a modify/start cycle on a type whose price is unknown
+                    logger.debug(f"Dropping {instance_type}: on-demand price unknown")
+                    continue
+                instance_types_with_prices.append((instance_type, prices[instance_type]))
             
-            # Sort by price and return just the instance types
-            sorted_instances = sorted(instance_types_with_prices, key=lambda x: x[1]) # Sort by price (second element in tuple)
+            # Keep the cheapest candidates only, the fallback loop rarely gets further
+            sorted_instances = _smallest(max_candidates, instance_types_with_prices, key=itemgetter(1)) # Sort by price (second element in tuple)
             return [instance_type for instance_type, _ in sorted_instances] # Return list of just the instance types
 
-
-            
         except ClientError as e:
             logger.error(f"Error getting compatible instance types: {e}")
             return []
 
-    def start_instance_with_fallback(self, instance_id: str) -> bool:
+    def filter_offered_instance_types(self, instance_types: List[str], availability_zone: str) -> List[str]:
+        """
+        Keep only the instance types offered in the given Availability Zone, preserving their order.
+
+        Args:
+            instance_types: The candidate instance types
+            availability_zone: The Availability Zone of the instance
+
+        Returns:
+            List[str]: The candidate instance types offered in the Availability Zone
+        """
+        offered_types = set()
+        try:
+            paginator = self.ec2_client.get_paginator('describe_instance_type_offerings')
+            for i in range(0, len(instance_types), DESCRIBE_INSTANCE_TYPES_BATCH_SIZE):
+                pages = paginator.paginate(
+                    LocationType='availability-zone',
+                    Filters=[
+                        {'Name': 'location', 'Values': [availability_zone]},
+                        {'Name': 'instance-type', 'Values': instance_types[i:i + DESCRIBE_INSTANCE_TYPES_BATCH_SIZE]}
+                    ]
+                )
+                for page in pages:
+                    offered_types.update(offering['InstanceType'] for offering in page['InstanceTypeOfferings'])
+        except ClientError as e:
+            logger.error(f"Error getting instance type offerings for {availability_zone}: {e}")
+            return instance_types
+
+        return [instance_type for instance_type in instance_types if instance_type in offered_types]
+
+    def start_instance_with_fallback(self, instance_id: str, instance: Optional[Dict[str, Any]] = None) -> bool:
         """
         Attempt to start an EC2 instance, falling back to different instance types if needed.
         Only processes instances with the 'Flexible' tag set to 'true'.
+        The instance is described unless its DescribeInstances entry is passed in.
         Returns True if successfully started, False otherwise.
         """
         try:
-            # Get current instance details
-            instance = self.ec2_resource.Instance(instance_id)
+            # Get current instance type, tags and placement in one call
+            if instance is None:
+                instance = self._describe(instance_id)
             
             # Check if instance has the flexible tag set to true
-            instance_tags = {tag['Key']: tag['Value'] for tag in instance.tags or []}
-            if instance_tags.get('Flexible', '').lower() != 'true':
+            flexible = next((tag['Value'] for tag in instance.get('Tags', []) if tag['Key'] == 'Flexible'), '')
+            if flexible.lower() != 'true':
                 logger.info(f"Instance {instance_id} does not have Flexible=true tag. Skipping recovery.")
                 return False
                 
-            instance_details = self.get_instance_details(instance_id)
-            instance.create_tags(
+            original_instance_type = instance['InstanceType']
+            self.ec2_client.create_tags(
+                Resources=[instance_id],
                 Tags=[
                     {
                         'Key': 'OriginalType',
-                        'Value': instance_details['instance_type']
+                        'Value': original_instance_type
                     }
                 ]
             )
 
             # First attempt to start with current instance type
             try:
-                logger.info(f"Attempting to start instance {instance_id} with current type {instance_details['instance_type']}")
-                instance.start()
-                # instance.wait_until_running()
+                logger.info(f"Attempting to start instance {instance_id} with current type {original_instance_type}")
+                self.ec2_client.start_instances(InstanceIds=[instance_id])
                 logger.info(f"Successfully started instance {instance_id}")
                 return True
             except ClientError as e:
@@ -254,30 +701,31 @@ class EC2InstanceManager:
                     logger.error(f"Error starting instance: {e}")
                     return False
                 else:
-                    logger.info(f"Attempt with type {instance_details['instance_type']} resulted in InsufficientInstanceCapacity error")
+                    logger.info(f"Attempt with type {original_instance_type} resulted in InsufficientInstanceCapacity error")
 
             
-            # If we get here, we need to try different instance types
-            compatible_types = self.get_compatible_instance_types(instance_details)
+            # If we get here, we need to try different instance types,
+            # only then are the type specifications loaded
+            instance_details = self.get_instance_details(instance)
+            compatible_types = self.get_compatible_instance_types(
+                instance_details, instance['Placement']['AvailabilityZone']
+            )
 
             logger.info(f"Original instance type {instance_details['instance_type']}")
             logger.info(f"We will attempt to start the instance with the following instance types: {compatible_types}")
             
             for new_type in compatible_types:
-                if new_type == instance_details['instance_type']:
-                    continue  # Skip current type as we already tried it
-                    
                 try:
                     logger.info(f"Attempting to modify instance type to {new_type}")
-                    instance.modify_attribute(
+                    self.ec2_client.modify_instance_attribute(
+                        InstanceId=instance_id,
                         InstanceType={
                             'Value': new_type
                         }
                     )
                     
                     # Try to start with new instance type
-                    instance.start()
-                    # instance.wait_until_running()
+                    self.ec2_client.start_instances(InstanceIds=[instance_id])
                     logger.info(f"Successfully started instance {instance_id} with new type {new_type}")
                     return True
                 except ClientError as e:
@@ -311,8 +759,8 @@ class EC2InstanceManager:
         try:
             # Revert back to original instance type
             logger.info(f"Reverting instance {instance_id} back to original type: {original_instance_type}")
-            instance = self.ec2_resource.Instance(instance_id)
-            instance.modify_attribute(
+            self.ec2_client.modify_instance_attribute(
+                InstanceId=instance_id,
                 InstanceType={'Value': original_instance_type}
             )
             
@@ -5,11 +5,24 @@ import boto3
 import time
 from botocore.exceptions import ClientError
 from typing import Dict, Any
-from datetime import datetime, timedelta
-from ec2_instance_manager import EC2InstanceManager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
+from ec2_instance_manager import EC2InstanceManager, custom_config, get_ec2_client, load_config
 
-# Timeout configuration
+# Timeout configuration, used when no Lambda context is available
 LAMBDA_TIMEOUT_SECONDS = 270  # 4 minutes 30 seconds
+# Time kept in reserve to return the results before the function times out
+TIMEOUT_MARGIN_SECONDS = 30
+# Time a start still running at the deadline is given to finish, taken from the margin above
+IN_FLIGHT_GRACE_SECONDS = 20
+
+# Duplicate events for an instance are ignored for 5 minutes
+DEDUP_TTL_SECONDS = 5 * 60
+# Size above which expired entries are pruned from the local dedup cache
+LOCAL_DEDUP_MAX_ENTRIES = 10_000
+
+# Maximum number of instances started concurrently, matching the EC2 client's connection pool
+MAX_START_WORKERS = 10
 
 
 # Configure logging
@@ -21,101 +34,176 @@ region = os.environ.get('AWS_REGION')
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.join(script_dir, 'config.json')
 
+# Dedup entries recorded by this container, keyed by instance ID with their ttl.
+# Duplicates usually reach the same warm container, which then skips the DynamoDB request
+_local_dedup: Dict[str, int] = {}
+
+# The client is created on first use and reused across warm Lambda invocations
+@lru_cache(maxsize=None)
+def _get_dynamodb_client():
+    return boto3.client('dynamodb', config=custom_config)
+
+# In Lambda, build the clients and parse the configuration during the init phase,
+# which runs before the first event, instead of during the first invocation
+if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    _get_dynamodb_client()
+    get_ec2_client(region)
+    load_config(config_path)
+
 def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
     """Lambda handler function"""
     start_time = time.time()
+    if context is not None:
+        deadline = start_time + context.get_remaining_time_in_millis() / 1000 - TIMEOUT_MARGIN_SECONDS
+    else:
+        deadline = start_time + LAMBDA_TIMEOUT_SECONDS
 
-    logger.info(f"Received event: {json.dumps(event)}")
+    # Serializing large CloudTrail events is only worth it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received event: %s", json.dumps(event, separators=(',', ':')))
     
-    detail = event.get('detail', {})
-    request_parameters = detail.get('requestParameters', {})
-    instance_ids = request_parameters.get('instancesSet', {}).get('items', [])
+    try:
+        detail = event['detail']
+        instance_ids = detail['requestParameters']['instancesSet']['items']
+    except (KeyError, TypeError):
+        instance_ids = None
     if not instance_ids:
         logger.error("No instance IDs found in the event")
         return {'statusCode': 400, 'body': 'No instance IDs found'}
-    
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(dedup_table_name)
+    event_time = detail.get('eventTime', '')
+
+    logger.info("Processing %d instance(s)", len(instance_ids))
+    dynamodb_client = _get_dynamodb_client()
 
     results = []
         
     instance_manager = EC2InstanceManager(region, config_path)
-    
-    # Process each instance separately
-    for item in instance_ids:
-        elapsed_time = time.time() - start_time
-        if elapsed_time >= LAMBDA_TIMEOUT_SECONDS:
-            logger.warning(f"Lambda timeout approaching ({elapsed_time:.2f}s). Stopping processing.")
-            results.append({
-                'message': f'Processing stopped due to timeout after {elapsed_time:.2f} seconds',
-                'remaining_instances': len(instance_ids) - len([r for r in results if 'instanceId' in r])
-            })
-            break
 
+    # Skip instances already processed within the ttl
+    # A conditional write checks and records the dedup entry in a single request
+    current_time = int(start_time)
+    ttl = current_time + DEDUP_TTL_SECONDS
+    new_instance_ids = []
+    for item in instance_ids:
         instance_id = item.get('instanceId')
-        if not instance_id:
+        if not instance_id or instance_id in new_instance_ids:
             continue 
 
-        current_time = int(datetime.now().timestamp())
-        try:
-            response = table.get_item(Key={'dedupKey': instance_id})
-            if 'Item' in response:
-                if response['Item']['ttl'] > current_time:
-                    logger.info(f"{response['Item']['ttl']}, {current_time}")
-                    logger.info(f"Duplicate event detected for instance {instance_id}. Skipping.")
-                    continue
-                else: 
-                    logger.info(f"Old event detected for instance {instance_id}. Processing and updating TTL.")
-        except ClientError as e:
-            logger.error(f"Error checking DynamoDB for existing event: {e}")
+        if _local_dedup.get(instance_id, 0) > current_time:
+            logger.info(f"Duplicate event detected for instance {instance_id}. Skipping.")
             continue
 
-
-
         # Use instance id as the deduplication key
         # This will be consistent across retry attempts within the ttl (5 minutes)
         dedup_key = instance_id
 
-    
         try:
-            table.put_item(
+            dynamodb_client.put_item(
+                TableName=dedup_table_name,
                 Item={
-                    'dedupKey': dedup_key,
-                    'timestamp': detail['eventTime'],
-                    'ttl': int((datetime.now() + timedelta(minutes=5)).timestamp())
-                }
+                    'dedupKey': {'S': dedup_key},
+                    'timestamp': {'S': event_time},
+                    'ttl': {'N': str(ttl)}
+                },
+                ConditionExpression='attribute_not_exists(dedupKey) OR #ttl <= :now',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={':now': {'N': str(current_time)}}
             )
-        
         except ClientError as e:
-            logger.error(f"Error putting new event into DynamoDB: {e}")
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.info(f"Duplicate event detected for instance {instance_id}. Skipping.")
+            else:
+                logger.error(f"Error putting new event into DynamoDB: {e}")
             continue
-        
+
+        _local_dedup[instance_id] = ttl
+        new_instance_ids.append(instance_id)
+
+    if len(_local_dedup) > LOCAL_DEDUP_MAX_ENTRIES:
+        for instance_id, entry_ttl in list(_local_dedup.items()):
+            if entry_ttl <= current_time:
+                del _local_dedup[instance_id]
+
+    if new_instance_ids:
         logger.info("TTL set, continuing processing...")
 
-        try:
-            # Try to start the instance
-            if instance_manager.start_instance_with_fallback(instance_id):
+    # Describe all instances of the event at once
+    instances = instance_manager.describe_instances(new_instance_ids)
+
+    # Instances are independent, so start them concurrently
+    executor = ThreadPoolExecutor(max_workers=max(1, min(MAX_START_WORKERS, len(new_instance_ids))))
+    futures = {
+        executor.submit(instance_manager.start_instance_with_fallback, instance_id, instances.get(instance_id)): instance_id
+        for instance_id in new_instance_ids
+    }
+    try:
+        # Wait for the starts until the deadline
+        _, pending = wait(futures, timeout=max(0, deadline - time.time()))
+
+        # Starts that have not begun yet are dropped. Running ones are given
+        # IN_FLIGHT_GRACE_SECONDS more to finish
+        remaining_instances = sum(future.cancel() for future in pending)
+
+        for future, instance_id in futures.items():
+            if future.cancelled():
+                # The instance was never attempted, release its dedup entry so a retry can start it
+                _local_dedup.pop(instance_id, None)
+                try:
+                    dynamodb_client.delete_item(
+                        TableName=dedup_table_name,
+                        Key={'dedupKey': {'S': instance_id}}
+                    )
+                except ClientError as e:
+                    logger.error(f"Error deleting dedup entry for instance {instance_id}: {e}")
+                continue
+            try:
+                started = future.result(timeout=max(0, deadline + IN_FLIGHT_GRACE_SECONDS - time.time()))
+            except TimeoutError:
+                # The start may still succeed, its dedup entry is kept so a retry does not repeat it
+                logger.warning(f"Start of instance {instance_id} still in progress at the deadline")
                 results.append({
                     'instanceId': instance_id,
-                    'status': 'started',
-                    'action': 'restart'
+                    'status': 'pending'
                 })
                 continue
-
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message': 'Processing complete',
-                    'results': results
+            if started:
+                results.append({
+                    'instanceId': instance_id,
+                    'status': 'started',
+                    'action': 'restart'
                 })
-            }
-        
-        except Exception as e:
-            logger.error(f"Error processing event: {str(e)}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps({
-                    'message': 'Error processing event',
-                    'error': str(e)
+            else:
+                results.append({
+                    'instanceId': instance_id,
+                    'status': 'failed'
                 })
-            }
\ No newline at end of file
+
+        if remaining_instances:
+            elapsed_time = time.time() - start_time
+            logger.warning(f"Lambda timeout approaching ({elapsed_time:.2f}s). Stopping processing.")
+            results.append({
+                'message': f'Processing stopped due to timeout after {elapsed_time:.2f} seconds',
+                'remaining_instances': remaining_instances
+            })
+
+    except Exception as e:
+        logger.error(f"Error processing event: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'message': 'Error processing event',
+                'error': str(e)
+            })
+        }
+
+    finally:
+        # Starts still in progress are not waited for
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Processing complete',
+            'results': results
+        })
+    }
@@ -0,0 +1,45 @@
+import json
+import logging
+import os
+from typing import Dict, Any
+from ec2_instance_manager import fetch_region_price_map, get_s3_client
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+price_catalog_bucket = os.environ.get('PRICE_CATALOG_BUCKET_NAME')
+region = os.environ.get('AWS_REGION')
+
+def handler(event: Dict[Any, Any], context: Any) -> Dict[str, Any]:
+    """Lambda handler function, publishes the region's on-demand price catalog to S3"""
+    try:
+        price_map = fetch_region_price_map(region)
+        if not price_map:
+            logger.error(f"No on-demand prices found for {region}")
+            return {'statusCode': 500, 'body': 'No on-demand prices found'}
+
+        get_s3_client().put_object(
+            Bucket=price_catalog_bucket,
+            Key=f"{region}.json",
+            Body=json.dumps(price_map),
+            ContentType='application/json'
+        )
+        logger.info(f"Published on-demand prices for {len(price_map)} instance types to s3://{price_catalog_bucket}/{region}.json")
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Price catalog refreshed',
+                'instanceTypes': len(price_map)
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Error refreshing price catalog: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'message': 'Error refreshing price catalog',
+                'error': str(e)
+            })
+        }
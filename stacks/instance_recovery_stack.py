@@ -7,6 +7,8 @@ from aws_cdk import (
     aws_events_targets as targets,
     aws_dynamodb as dynamodb,
     aws_ssm as ssm,
+    aws_s3 as s3,
+    custom_resources as cr,
     Duration,
     RemovalPolicy
 )
@@ -30,6 +32,24 @@ class InstanceRecoveryStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
         
+        # Create S3 bucket for the daily refreshed on-demand price catalog
+        price_catalog_bucket = s3.Bucket(
+            self, "PriceCatalogBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            removal_policy=RemovalPolicy.DESTROY  # For easy cleanup in development
+        )
+        NagSuppressions.add_resource_suppressions(
+            price_catalog_bucket,
+            [
+                {
+                    "id": "AwsSolutions-S1",
+                    "reason": "The bucket only holds a public price list snapshot that is regenerated daily, access logs are not required."
+                }
+            ]
+        )
+
         # Create a custom role for the start lambda function
         start_handler_role = iam.Role(
             self, "InstanceRecoveryLambdaRole",
@@ -63,14 +83,18 @@ class InstanceRecoveryStack(Stack):
         start_handler = lambda_.Function(
             self, "InstanceRecoveryHandler",
             runtime=lambda_.Runtime.PYTHON_3_13,
-            code=lambda_.Code.from_asset("lambda_start"),
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("lambda_start", exclude=["__pycache__"]),
             handler="instance_recovery.handler",
             timeout=Duration.minutes(5),
-            memory_size=256,
+            # 1769 MB is the smallest size that gets a full vCPU for parsing prices and catalogs
+            memory_size=1769,
             role=start_handler_role,
             environment={
                 "LOG_LEVEL": "INFO",
-                "DEDUP_TABLE_NAME": dedup_table.table_name
+                "DEDUP_TABLE_NAME": dedup_table.table_name,
+                "CACHE_DIR": "/tmp/flex-starter",
+                "PRICE_CATALOG_BUCKET_NAME": price_catalog_bucket.bucket_name
             },
             log_group=start_handler_loggroup
         )
@@ -80,17 +104,6 @@ class InstanceRecoveryStack(Stack):
         start_handler.add_to_role_policy(iam.PolicyStatement(
             actions=[
                 "ec2:StartInstances",
-            ],
-            resources=[f"arn:aws:ec2:{self.region}:{self.account}:instance/*"],
-            conditions={
-                "StringEquals": {
-                    "aws:ResourceTag/Flexible": "true"
-                }
-            }
-        ))
-        # Separate policy for ModifyInstanceAttribute with instanceType restriction
-        start_handler.add_to_role_policy(iam.PolicyStatement(
-            actions=[
                 "ec2:ModifyInstanceAttribute",
             ],
             resources=[f"arn:aws:ec2:{self.region}:{self.account}:instance/*"],
@@ -121,6 +134,7 @@ class InstanceRecoveryStack(Stack):
                 "ec2:DescribeInstances",
                 "ec2:DescribeTags",
                 "ec2:DescribeInstanceTypes",
+                "ec2:DescribeInstanceTypeOfferings",
                 "ec2:GetInstanceTypesFromInstanceRequirements"
             ],
             resources=["*"],
@@ -140,6 +154,9 @@ class InstanceRecoveryStack(Stack):
         # Grant DynamoDB permissions to Lambda
         dedup_table.grant_read_write_data(start_handler)
 
+        # Grant read access to the price catalog
+        price_catalog_bucket.grant_read(start_handler)
+
         # Create CloudWatch Event Rule
         rule = events.Rule(
             self, "StartInstancesFailureRule",
@@ -149,6 +166,14 @@ class InstanceRecoveryStack(Stack):
                     "eventSource": ["ec2.amazonaws.com"],
                     "eventName": ["StartInstances"],
                     "errorCode": ["Server.InsufficientInstanceCapacity"],
+                    # Drop events without instance IDs before they invoke the Lambda
+                    "requestParameters": {
+                        "instancesSet": {
+                            "items": {
+                                "instanceId": [{"exists": True}]
+                            }
+                        }
+                    },
                     "userIdentity": {
                         "sessionContext": {
                             "sessionIssuer": {
@@ -163,6 +188,89 @@ class InstanceRecoveryStack(Stack):
         # Add Lambda as target
         rule.add_target(targets.LambdaFunction(start_handler))
 
+        # Create a custom role for the price catalog refresh lambda function
+        price_refresh_handler_role = iam.Role(
+            self, "PriceCatalogRefreshLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+        )
+        price_refresh_handler_role.add_to_policy(iam.PolicyStatement(
+            actions=[
+                "logs:CreateLogGroup",
+                "logs:CreateLogStream",
+                "logs:PutLogEvents"
+            ],
+            resources=["arn:aws:logs:" + self.region + ":" + self.account + ":log-group:/aws/lambda/PriceCatalogRefreshHandler:*"]
+        ))
+
+        # Create a log group for the price catalog refresh handler
+        price_refresh_handler_loggroup = logs.LogGroup(
+            self, "PriceCatalogRefreshHandlerLogGroup",
+            log_group_name="/aws/lambda/PriceCatalogRefreshHandler",
+            retention=logs.RetentionDays.ONE_MONTH
+        )
+
+        # Create Price Catalog Refresh Lambda function
+        price_refresh_handler = lambda_.Function(
+            self, "PriceCatalogRefreshHandler",
+            runtime=lambda_.Runtime.PYTHON_3_13,
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("lambda_start", exclude=["__pycache__"]),
+            handler="price_catalog_refresh.handler",
+            timeout=Duration.minutes(5),
+            memory_size=1769,
+            role=price_refresh_handler_role,
+            environment={
+                "LOG_LEVEL": "INFO",
+                "PRICE_CATALOG_BUCKET_NAME": price_catalog_bucket.bucket_name
+            },
+            log_group=price_refresh_handler_loggroup
+        )
+        price_refresh_handler.add_to_role_policy(iam.PolicyStatement(
+            actions=[
+                "pricing:GetProducts"
+            ],
+            resources=["*"]
+        ))
+        price_catalog_bucket.grant_put(price_refresh_handler)
+
+        # Refresh the price catalog daily
+        price_refresh_rule = events.Rule(
+            self, "PriceCatalogRefreshRule",
+            schedule=events.Schedule.rate(Duration.days(1))
+        )
+        price_refresh_rule.add_target(targets.LambdaFunction(price_refresh_handler))
+
+        # Publish the price catalog once at deployment, the schedule first runs up to a day later
+        cr.AwsCustomResource(
+            self, "PriceCatalogInitialRefresh",
+            on_create=cr.AwsSdkCall(
+                service="Lambda",
+                action="invoke",
+                parameters={
+                    "FunctionName": price_refresh_handler.function_name,
+                    "InvocationType": "Event"
+                },
+                physical_resource_id=cr.PhysicalResourceId.of("PriceCatalogInitialRefresh")
+            ),
+            policy=cr.AwsCustomResourcePolicy.from_statements([
+                iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[price_refresh_handler.function_arn]
+                )
+            ]),
+            install_latest_aws_sdk=False
+        )
+        NagSuppressions.add_resource_suppressions_by_path(
+            self,
+            f"/{self.stack_name}/AWS679f53fac002430cb0da5b7982bd2287/ServiceRole/Resource",
+            [
+                {
+                    "id": "AwsSolutions-IAM4",
+                    "reason": "The CDK provider function that invokes the initial price catalog refresh only needs the AWSLambdaBasicExecutionRole managed policy."
+                }
+            ]
+        )
+
         # Create a custom role for the start lambda function
         stop_handler_role = iam.Role(
             self, "InstanceStopLambdaRole",
@@ -188,7 +296,8 @@ class InstanceRecoveryStack(Stack):
         stop_handler = lambda_.Function(
             self, "InstanceStopHandler",
             runtime=lambda_.Runtime.PYTHON_3_13,
-            code=lambda_.Code.from_asset("lambda-stop"),
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("lambda-stop", exclude=["__pycache__"]),
             handler="instance_stop.handler",
             timeout=Duration.minutes(5),
             role=stop_handler_role,
@@ -231,6 +340,7 @@ class InstanceRecoveryStack(Stack):
         stop_handler.add_to_role_policy(iam.PolicyStatement(
             actions=[
                 "ec2:DescribeInstances",
+                "ec2:DescribeInstanceStatus",
                 "ec2:DescribeTags",
                 "ec2:DescribeInstanceTypes"
             ],
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Make the Lambda function modules importable, once for the whole test session
+tests_dir = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(tests_dir, '..', 'lambda_start'))
+sys.path.insert(0, os.path.join(tests_dir, '..', 'lambda-stop'))
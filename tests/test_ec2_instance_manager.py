@@ -0,0 +1,429 @@
+import unittest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
+import io
+import json
+import os
+import tempfile
+import time
+
+import ec2_instance_manager
+from ec2_instance_manager import EC2InstanceManager, _extract_ondemand_price, fetch_region_price_map
+
+config_path = os.path.join(os.path.dirname(ec2_instance_manager.__file__), 'config.json')
+
+def price_list_entry(instance_type, usd):
+    """Build a Pricing API price list entry as returned by GetProducts."""
+    entry = {
+        'product': {'attributes': {'instanceType': instance_type} if instance_type else {}},
+        'terms': {'OnDemand': {}}
+    }
+    if usd is not None:
+        entry['terms']['OnDemand']['TERM'] = {
+            'priceDimensions': {'DIMENSION': {'pricePerUnit': {'USD': usd}}}
+        }
+    return json.dumps(entry)
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        patcher = patch('ec2_instance_manager.CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def test_put_then_get(self):
+        ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': 0.096})
+
+        self.assertEqual(ec2_instance_manager._disk_cache_get('prices-eu-central-1'), {'m5.large': 0.096})
+        self.assertEqual(os.listdir(self.cache_dir), ['prices-eu-central-1.json'])
+
+    def test_get_missing_entry(self):
+        self.assertIsNone(ec2_instance_manager._disk_cache_get('prices-eu-central-1'))
+
+    def test_get_expired_entry(self):
+        ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': 0.096})
+        expired = time.time() - ec2_instance_manager.CACHE_TTL_SECONDS - 60
+        os.utime(self.entry_path('prices-eu-central-1'), (expired, expired))
+
+        self.assertIsNone(ec2_instance_manager._disk_cache_get('prices-eu-central-1'))
+
+    def test_get_corrupt_entry(self):
+        with open(self.entry_path('prices-eu-central-1'), 'w') as cache_file:
+            cache_file.write('{"m5.large": 0.0')
+
+        self.assertIsNone(ec2_instance_manager._disk_cache_get('prices-eu-central-1'))
+
+    def test_get_does_not_refresh_entry(self):
+        ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': 0.096})
+        written = time.time() - 3600
+        os.utime(self.entry_path('prices-eu-central-1'), (written, written))
+
+        ec2_instance_manager._disk_cache_get('prices-eu-central-1')
+
+        self.assertEqual(os.path.getmtime(self.entry_path('prices-eu-central-1')), written)
+
+    def test_put_replaces_entry_from_temporary_file(self):
+        with patch('ec2_instance_manager.os.replace', wraps=os.replace) as mock_replace:
+            ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': 0.096})
+
+        source, destination = mock_replace.call_args.args
+        self.assertEqual(os.path.dirname(source), self.cache_dir)
+        self.assertTrue(source.endswith('.tmp'))
+        self.assertEqual(destination, self.entry_path('prices-eu-central-1'))
+
+    def test_put_failed_replace_removes_temporary_file(self):
+        with patch('ec2_instance_manager.os.replace', side_effect=OSError('No space left on device')):
+            ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': 0.096})
+
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_put_unserializable_value_removes_temporary_file(self):
+        ec2_instance_manager._disk_cache_put('prices-eu-central-1', {'m5.large': object()})
+
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+@patch('ec2_instance_manager._disk_cache_put')
+@patch('ec2_instance_manager._disk_cache_get', return_value=None)
+class TestPricing(unittest.TestCase):
+    def setUp(self):
+        # Clients and prices are cached at module level; drop them so each test gets its own mocks
+        ec2_instance_manager.get_ec2_client.cache_clear()
+        ec2_instance_manager.get_pricing_client.cache_clear()
+        ec2_instance_manager._get_ondemand_price_cached.cache_clear()
+
+    def test_extract_ondemand_price(self, mock_disk_cache_get, mock_disk_cache_put):
+        self.assertEqual(_extract_ondemand_price(json.loads(price_list_entry('m5.large', '0.0960000000'))), 0.096)
+        self.assertIsNone(_extract_ondemand_price(json.loads(price_list_entry('m5.large', None))))
+        self.assertIsNone(_extract_ondemand_price({}))
+
+    @patch('boto3.client')
+    def test_fetch_region_price_map(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        mock_paginate = mock_boto3_client.return_value.get_paginator.return_value.paginate
+        mock_paginate.return_value = [
+            {'PriceList': [price_list_entry('m5.large', '0.096'), price_list_entry(None, '0.01')]},
+            {'PriceList': [price_list_entry('m6i.large', None), price_list_entry('c5.large', '0.085')]}
+        ]
+
+        price_map = fetch_region_price_map('eu-central-1')
+
+        # Entries without an instance type or an on-demand USD price are skipped
+        self.assertEqual(price_map, {'m5.large': 0.096, 'c5.large': 0.085})
+        filters = mock_paginate.call_args.kwargs['Filters']
+        self.assertIn({'Type': 'TERM_MATCH', 'Field': 'regionCode', 'Value': 'eu-central-1'}, filters)
+
+    @patch('boto3.client')
+    def test_get_ondemand_prices_from_region_map(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch.dict(ec2_instance_manager._region_price_maps, {'eu-central-1': {'m5.large': 0.096, 'c5.large': 0.085}}):
+            prices = manager.get_ondemand_prices(['m5.large', 'c5.large'])
+
+        self.assertEqual(prices, {'m5.large': 0.096, 'c5.large': 0.085})
+        mock_boto3_client.return_value.get_products.assert_not_called()
+
+    @patch.dict(ec2_instance_manager._region_price_maps, clear=True)
+    @patch('boto3.client')
+    def test_region_price_map_from_disk_cache_is_not_rewritten(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch('ec2_instance_manager._disk_cache_get', return_value={'m5.large': 0.096}):
+            price_map = manager.load_region_prices()
+
+        # Rewriting the entry would refresh its mtime, so the ttl would never expire
+        self.assertEqual(price_map, {'m5.large': 0.096})
+        mock_disk_cache_put.assert_not_called()
+        mock_boto3_client.return_value.get_paginator.assert_not_called()
+
+    @patch.dict(ec2_instance_manager._region_price_maps, clear=True)
+    @patch('boto3.client')
+    def test_region_price_map_fetched_is_cached_on_disk(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch('ec2_instance_manager.fetch_region_price_map', return_value={'m5.large': 0.096}):
+            price_map = manager.load_region_prices()
+
+        self.assertEqual(price_map, {'m5.large': 0.096})
+        mock_disk_cache_put.assert_called_once_with('prices-eu-central-1', {'m5.large': 0.096})
+
+    @patch.dict(ec2_instance_manager._region_price_maps, clear=True)
+    @patch('boto3.client')
+    def test_region_price_map_empty_is_not_kept(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch('ec2_instance_manager.fetch_region_price_map', side_effect=[{}, {'m5.large': 0.096}]):
+            first = manager.load_region_prices()
+            second = manager.load_region_prices()
+
+        # An empty result is loaded again instead of being kept for the life of the process
+        self.assertEqual(first, {})
+        self.assertEqual(second, {'m5.large': 0.096})
+        self.assertEqual(ec2_instance_manager._region_price_maps, {'eu-central-1': {'m5.large': 0.096}})
+
+    @patch('boto3.client')
+    def test_get_ondemand_prices_looks_up_missing_types(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        def get_products(Filters, **kwargs):
+            instance_type = next(f['Value'] for f in Filters if f['Field'] == 'instanceType')
+            if instance_type == 'm6i.large':
+                return {'PriceList': [price_list_entry('m6i.large', '0.1')]}
+            if instance_type == 'x1.unpriced':
+                return {'PriceList': [price_list_entry('x1.unpriced', None)]}
+            return {'PriceList': []}
+        mock_boto3_client.return_value.get_products.side_effect = get_products
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch.dict(ec2_instance_manager._region_price_maps, {'eu-central-1': {'m5.large': 0.096}}):
+            prices = manager.get_ondemand_prices(['m5.large', 'm6i.large', 'x1.unpriced', 'x1.unknown'])
+
+        # Types missing from the map are priced individually, unknown prices are None
+        self.assertEqual(prices, {'m5.large': 0.096, 'm6i.large': 0.1, 'x1.unpriced': None, 'x1.unknown': None})
+        self.assertEqual(mock_boto3_client.return_value.get_products.call_count, 3)
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', True)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_drops_unpriced_types(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': t} for t in ('m5.large', 'm6i.large', 'm7i.large', 'c5.xlarge')]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        prices = {'m6i.large': 0.1, 'm7i.large': None, 'c5.xlarge': 0.085}
+        with patch.object(manager, 'get_ondemand_prices', return_value=prices) as mock_get_prices:
+            alternatives = manager.get_compatible_instance_types({
+                'instance_type': 'm5.large',
+                'instance_type_info': {'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}},
+                'tags': [],
+                'vcpu': 2,
+                'memory_mib': 8192
+            })
+
+        # Cheapest first, without the original type or types whose price is unknown
+        self.assertEqual(alternatives, ['c5.xlarge', 'm6i.large'])
+        mock_get_prices.assert_called_once_with(['m6i.large', 'm7i.large', 'c5.xlarge'])
+
+@patch('ec2_instance_manager.PRICE_CATALOG_BUCKET', 'price-catalog-bucket')
+class TestPriceCatalog(unittest.TestCase):
+    def setUp(self):
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        ec2_instance_manager.get_ec2_client.cache_clear()
+        ec2_instance_manager.get_s3_client.cache_clear()
+
+    def mock_catalog_object(self, mock_boto3_client, age):
+        mock_boto3_client.return_value.get_object.return_value = {
+            'Body': io.BytesIO(json.dumps({'m5.large': 0.096}).encode()),
+            'LastModified': datetime.now(timezone.utc) - age
+        }
+
+    @patch('boto3.client')
+    def test_load_price_catalog_from_s3(self, mock_boto3_client):
+        self.mock_catalog_object(mock_boto3_client, timedelta(hours=12))
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+
+        self.assertEqual(manager._load_price_catalog_from_s3(), {'m5.large': 0.096})
+        mock_boto3_client.return_value.get_object.assert_called_once_with(
+            Bucket='price-catalog-bucket', Key='eu-central-1.json'
+        )
+
+    @patch('boto3.client')
+    def test_load_price_catalog_from_s3_ignores_stale_catalog(self, mock_boto3_client):
+        self.mock_catalog_object(mock_boto3_client, timedelta(days=30))
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+
+        self.assertIsNone(manager._load_price_catalog_from_s3())
+
+    @patch('boto3.client')
+    def test_load_price_catalog_from_s3_missing_object(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}},
+            'GetObject'
+        )
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+
+        self.assertIsNone(manager._load_price_catalog_from_s3())
+
+    @patch('boto3.client')
+    def test_load_price_catalog_from_s3_without_bucket(self, mock_boto3_client):
+        manager = EC2InstanceManager('eu-central-1', config_path)
+
+        with patch('ec2_instance_manager.PRICE_CATALOG_BUCKET', None):
+            self.assertIsNone(manager._load_price_catalog_from_s3())
+        mock_boto3_client.return_value.get_object.assert_not_called()
+
+PARAMETER_ARN = 'arn:aws:ssm:eu-central-1:123456789012:parameter/flexible-instance-starter/web'
+DEFAULT_PARAMETER = '/flexible-instance-starter/default'
+
+@patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+class TestFlexibleConfiguration(unittest.TestCase):
+    def setUp(self):
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        ec2_instance_manager.get_ec2_client.cache_clear()
+        ec2_instance_manager.get_ssm_client.cache_clear()
+
+    def parameter(self, value):
+        return {'Parameter': {'Value': value}}
+
+    def client_error(self, code):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, 'GetParameter')
+
+    def requested_parameters(self, mock_boto3_client):
+        return [call.kwargs['Name'] for call in mock_boto3_client.return_value.get_parameter.call_args_list]
+
+    @patch('boto3.client')
+    def test_parameter_cached_within_ttl(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_parameter.return_value = self.parameter('{"maxCpuMultiplier": 4}')
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch('ec2_instance_manager.time.time', return_value=1000):
+            first = manager.get_flexible_configuration(PARAMETER_ARN)
+        with patch('ec2_instance_manager.time.time', return_value=1000 + ec2_instance_manager.FLEXIBLE_CONFIGURATION_TTL_SECONDS - 1):
+            second = manager.get_flexible_configuration(PARAMETER_ARN)
+
+        self.assertEqual(first, {'maxCpuMultiplier': 4})
+        self.assertEqual(second, first)
+        self.assertEqual(self.requested_parameters(mock_boto3_client), [PARAMETER_ARN])
+
+        # After the TTL the parameter is read again
+        with patch('ec2_instance_manager.time.time', return_value=1000 + ec2_instance_manager.FLEXIBLE_CONFIGURATION_TTL_SECONDS):
+            manager.get_flexible_configuration(PARAMETER_ARN)
+        self.assertEqual(self.requested_parameters(mock_boto3_client), [PARAMETER_ARN, PARAMETER_ARN])
+
+    @patch('boto3.client')
+    def test_parameter_not_found_cached(self, mock_boto3_client):
+        def get_parameter(Name):
+            if Name != DEFAULT_PARAMETER:
+                raise self.client_error('ParameterNotFound')
+            return self.parameter('{"maxCpuMultiplier": 3}')
+        mock_boto3_client.return_value.get_parameter.side_effect = get_parameter
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        configs = [manager.get_flexible_configuration(PARAMETER_ARN) for _ in range(2)]
+
+        # The missing parameter falls back to the default and is not requested again
+        self.assertEqual(configs, [{'maxCpuMultiplier': 3}] * 2)
+        self.assertEqual(self.requested_parameters(mock_boto3_client), [PARAMETER_ARN, DEFAULT_PARAMETER])
+
+    @patch('boto3.client')
+    def test_throttling_not_cached(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_parameter.side_effect = [
+            self.client_error('ThrottlingException'),
+            self.parameter('{"maxCpuMultiplier": 3}'),
+            self.parameter('{"maxCpuMultiplier": 4}')
+        ]
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        first = manager.get_flexible_configuration(PARAMETER_ARN)
+        second = manager.get_flexible_configuration(PARAMETER_ARN)
+
+        # The throttled read falls back to the default and is retried on the next call
+        self.assertEqual(first, {'maxCpuMultiplier': 3})
+        self.assertEqual(second, {'maxCpuMultiplier': 4})
+        self.assertEqual(self.requested_parameters(mock_boto3_client), [PARAMETER_ARN, DEFAULT_PARAMETER, PARAMETER_ARN])
+
+    @patch('boto3.client')
+    def test_invalid_json_not_cached(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_parameter.side_effect = [
+            self.parameter('{not json'),
+            self.parameter('{"maxCpuMultiplier": 3}'),
+            self.parameter('{"maxCpuMultiplier": 4}')
+        ]
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        first = manager.get_flexible_configuration(PARAMETER_ARN)
+        second = manager.get_flexible_configuration(PARAMETER_ARN)
+
+        self.assertEqual(first, {'maxCpuMultiplier': 3})
+        self.assertEqual(second, {'maxCpuMultiplier': 4})
+        self.assertEqual(self.requested_parameters(mock_boto3_client), [PARAMETER_ARN, DEFAULT_PARAMETER, PARAMETER_ARN])
+
+class TestInstanceTypeOfferings(unittest.TestCase):
+    def setUp(self):
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        ec2_instance_manager.get_ec2_client.cache_clear()
+
+    @patch('boto3.client')
+    def test_filter_offered_instance_types_preserves_order(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_paginator.return_value.paginate.return_value = [
+            {'InstanceTypeOfferings': [{'InstanceType': 'm5.large'}]},
+            {'InstanceTypeOfferings': [{'InstanceType': 'c5.large'}]}
+        ]
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        offered_types = manager.filter_offered_instance_types(['c5.large', 'm6i.large', 'm5.large'], 'eu-central-1a')
+
+        self.assertEqual(offered_types, ['c5.large', 'm5.large'])
+        mock_boto3_client.return_value.get_paginator.assert_called_once_with('describe_instance_type_offerings')
+
+    @patch('boto3.client')
+    def test_filter_offered_instance_types_in_chunks_of_100(self, mock_boto3_client):
+        instance_types = [f'm5.type{i}' for i in range(150)]
+        mock_paginate = mock_boto3_client.return_value.get_paginator.return_value.paginate
+        mock_paginate.side_effect = lambda Filters, **kwargs: [{
+            'InstanceTypeOfferings': [{'InstanceType': t} for t in Filters[1]['Values'][::2]]
+        }]
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        offered_types = manager.filter_offered_instance_types(instance_types, 'eu-central-1a')
+
+        self.assertEqual(offered_types, instance_types[:100:2] + instance_types[100::2])
+        chunks = [call.kwargs['Filters'] for call in mock_paginate.call_args_list]
+        self.assertEqual([chunk[1]['Values'] for chunk in chunks], [instance_types[:100], instance_types[100:]])
+        self.assertEqual([chunk[0] for chunk in chunks], [{'Name': 'location', 'Values': ['eu-central-1a']}] * 2)
+
+    @patch('boto3.client')
+    def test_filter_offered_instance_types_error_keeps_all(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_paginator.return_value.paginate.side_effect = ClientError(
+            {'Error': {'Code': 'UnauthorizedOperation', 'Message': 'Not authorized'}},
+            'DescribeInstanceTypeOfferings'
+        )
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        offered_types = manager.filter_offered_instance_types(['c5.large', 'm5.large'], 'eu-central-1a')
+
+        # Without offerings, every candidate is kept and tried
+        self.assertEqual(offered_types, ['c5.large', 'm5.large'])
+
+class TestDescribeTypesBulk(unittest.TestCase):
+    def setUp(self):
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        ec2_instance_manager.get_ec2_client.cache_clear()
+
+    @patch.dict(ec2_instance_manager._instance_type_catalogs, clear=True)
+    @patch('boto3.client')
+    def test_describe_types_bulk_without_catalog(self, mock_boto3_client):
+        mock_boto3_client.return_value.describe_instance_types.return_value = {
+            'InstanceTypes': [{'InstanceType': 'm5.large'}]
+        }
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        specs = manager.describe_types_bulk(['m5.large'])
+
+        # Only the requested type is described, the region catalog is not loaded
+        self.assertEqual(specs, {'m5.large': {'InstanceType': 'm5.large'}})
+        mock_boto3_client.return_value.describe_instance_types.assert_called_once_with(InstanceTypes=['m5.large'])
+        mock_boto3_client.return_value.get_paginator.assert_not_called()
+        self.assertNotIn('eu-central-1', ec2_instance_manager._instance_type_catalogs)
+
+    @patch('boto3.client')
+    def test_describe_types_bulk_adds_missing_types_to_catalog(self, mock_boto3_client):
+        mock_boto3_client.return_value.describe_instance_types.return_value = {
+            'InstanceTypes': [{'InstanceType': 'm8i.large'}]
+        }
+        catalog = {'m5.large': {'InstanceType': 'm5.large'}}
+
+        manager = EC2InstanceManager('eu-central-1', config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            specs = manager.describe_types_bulk(['m5.large', 'm8i.large'])
+
+        self.assertEqual(list(specs), ['m5.large', 'm8i.large'])
+        mock_boto3_client.return_value.describe_instance_types.assert_called_once_with(InstanceTypes=['m8i.large'])
+        self.assertIn('m8i.large', catalog)
+
+if __name__ == '__main__':
+    unittest.main()
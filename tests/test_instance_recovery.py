@@ -1,135 +1,541 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, Mock
+from botocore.exceptions import ClientError
 import json
-import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Add the lambda directory to the Python path
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+import ec2_instance_manager
+import instance_recovery
+from instance_recovery import handler, _get_dynamodb_client
+from ec2_instance_manager import EC2InstanceManager, get_ec2_client
 
-from instance_recovery import handler
-from ec2_instance_manager import EC2InstanceManager
+# StartInstances event shared by the tests, which never modify it
+_EVENT_RECOVERY = {
+    'detail': {
+        'userIdentity': {
+            'principalId': 'AROAEXAMPLE:user'
+        },
+        'sessionContext': {
+            'attributes': {
+                'creationDate': '2023-01-01T00:00:00Z'
+            }
+        },
+        'eventTime': '2023-01-01T00:00:00Z',
+        'requestParameters': {
+            'instancesSet': {
+                'items': [
+                    {'instanceId': 'i-1234567890abcdef0'},
+                    {'instanceId': 'i-0987654321fedcba0'}
+                ]
+            }
+        }
+    }
+}
 
 class TestInstanceRecovery(unittest.TestCase):
     def setUp(self):
-        self.event = {
-            'detail': {
-                'userIdentity': {
-                    'principalId': 'AROAEXAMPLE:user'
-                },
-                'sessionContext': {
-                    'attributes': {
-                        'creationDate': '2023-01-01T00:00:00Z'
-                    }
-                },
-                'eventTime': '2023-01-01T00:00:00Z',
-                'requestParameters': {
-                    'instancesSet': {
-                        'items': [
-                            {'instanceId': 'i-1234567890abcdef0'},
-                            {'instanceId': 'i-0987654321fedcba0'}
-                        ]
-                    }
-                }
-            }
-        }
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        _get_dynamodb_client.cache_clear()
+        get_ec2_client.cache_clear()
+        instance_recovery._local_dedup.clear()
+
+        self.event = _EVENT_RECOVERY
+
+    @patch('boto3.client')
+    def test_handler_deduplication(self, mock_boto3_client):
+        # Mock DynamoDB conditional check failure
+        mock_boto3_client.return_value.put_item.side_effect = ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+            'PutItem'
+        )
+
+        with patch.object(EC2InstanceManager, 'start_instance_with_fallback') as mock_start_instance:
+            response = handler(self.event, None)
 
-    @patch('boto3.resource')
-    def test_handler_deduplication(self, mock_boto3_resource):
-        # Mock DynamoDB table and conditional check failure
-        mock_table = MagicMock()
-        mock_boto3_resource.return_value.Table.return_value = mock_table
-        mock_table.put_item.side_effect = mock_boto3_resource.return_value.meta.client.exceptions.ConditionalCheckFailedException({}, "ConditionalCheckFailed")
-        
-        response = handler(self.event, None)
-        
         self.assertEqual(response['statusCode'], 200)
-        self.assertEqual(response['body'], 'Duplicate event, skipped processing')
-        mock_table.put_item.assert_called_once()
+        self.assertEqual(json.loads(response['body'])['results'], [])
+        self.assertEqual(mock_boto3_client.return_value.put_item.call_count, 2)
+        mock_start_instance.assert_not_called()
 
-    @patch('boto3.resource')
+    @patch('boto3.client')
     @patch.object(EC2InstanceManager, 'start_instance_with_fallback')
-    def test_handler_successful_restart(self, mock_start_instance, mock_boto3_resource):
-        # Mock DynamoDB table
-        mock_table = MagicMock()
-        mock_boto3_resource.return_value.Table.return_value = mock_table
-        
+    def test_handler_successful_restart(self, mock_start_instance, mock_boto3_client):
         # Mock successful start
         mock_start_instance.return_value = True
-        
+
         response = handler(self.event, None)
-        
+
         self.assertEqual(response['statusCode'], 200)
         results = json.loads(response['body'])['results']
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0]['status'], 'started')
         self.assertEqual(results[0]['action'], 'restart')
-        mock_table.put_item.assert_called_once()
-
-    @patch('boto3.resource')
-    def test_start_instance_with_fallback_flexible_tag(self, mock_boto3_resource):
-        # Create mock instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [{'Key': 'Flexible', 'Value': 'true'}]
-        mock_instance.instance_type = 't3.micro'
-        mock_instance.start.return_value = None
-        
-        # Mock EC2 resource and client
-        mock_ec2_resource = MagicMock()
-        mock_ec2_resource.Instance.return_value = mock_instance
-        mock_boto3_resource.return_value = mock_ec2_resource
-        
+        self.assertEqual(mock_boto3_client.return_value.put_item.call_count, 2)
+        # Both instances are described in a single call
+        mock_boto3_client.return_value.describe_instances.assert_called_once_with(
+            InstanceIds=['i-1234567890abcdef0', 'i-0987654321fedcba0']
+        )
+
+    @patch('boto3.client')
+    @patch.object(EC2InstanceManager, 'start_instance_with_fallback')
+    def test_handler_local_dedup_hit_skips_dynamodb(self, mock_start_instance, mock_boto3_client):
+        mock_start_instance.return_value = True
+        instance_recovery._local_dedup['i-1234567890abcdef0'] = int(time.time()) + 60
+
+        handler(self.event, None)
+
+        # Only the instance missing from the local cache is recorded and started
+        mock_boto3_client.return_value.put_item.assert_called_once()
+        self.assertEqual(
+            mock_boto3_client.return_value.put_item.call_args.kwargs['Item']['dedupKey'],
+            {'S': 'i-0987654321fedcba0'}
+        )
+        mock_start_instance.assert_called_once()
+        self.assertIn('i-0987654321fedcba0', instance_recovery._local_dedup)
+
+    @patch('boto3.client')
+    @patch.object(EC2InstanceManager, 'start_instance_with_fallback')
+    def test_handler_local_dedup_expired_entry(self, mock_start_instance, mock_boto3_client):
+        mock_start_instance.return_value = True
+        instance_recovery._local_dedup['i-1234567890abcdef0'] = int(time.time()) - 1
+
+        handler(self.event, None)
+
+        # The expired entry falls through to DynamoDB and is renewed
+        self.assertEqual(mock_boto3_client.return_value.put_item.call_count, 2)
+        self.assertEqual(mock_start_instance.call_count, 2)
+        self.assertGreater(instance_recovery._local_dedup['i-1234567890abcdef0'], time.time())
+
+    @patch('instance_recovery.LOCAL_DEDUP_MAX_ENTRIES', 2)
+    @patch('boto3.client')
+    @patch.object(EC2InstanceManager, 'start_instance_with_fallback')
+    def test_handler_local_dedup_pruning(self, mock_start_instance, mock_boto3_client):
+        mock_start_instance.return_value = True
+        now = int(time.time())
+        instance_recovery._local_dedup.update({'i-expired1': now - 10, 'i-expired2': now, 'i-current': now + 60})
+
+        handler(self.event, None)
+
+        # Above the limit, expired entries are dropped and current ones kept
+        self.assertEqual(
+            set(instance_recovery._local_dedup),
+            {'i-current', 'i-1234567890abcdef0', 'i-0987654321fedcba0'}
+        )
+
+    @patch('boto3.client')
+    @patch.object(EC2InstanceManager, 'start_instance_with_fallback')
+    def test_handler_reuses_clients(self, mock_start_instance, mock_boto3_client):
+        mock_start_instance.return_value = True
+
+        handler(self.event, None)
+        instance_recovery._local_dedup.clear()
+        handler(self.event, None)
+
+        # One DynamoDB and one EC2 client, shared by both invocations
+        service_names = [call.args[0] for call in mock_boto3_client.call_args_list]
+        self.assertEqual(sorted(service_names), ['dynamodb', 'ec2'])
+
+    @patch.dict(os.environ, {'AWS_DEFAULT_REGION': 'eu-central-1'})
+    def test_clients_keep_connections_alive(self):
+        self.assertTrue(_get_dynamodb_client().meta.config.tcp_keepalive)
+        self.assertTrue(get_ec2_client('eu-central-1').meta.config.tcp_keepalive)
+
+    def test_handler_no_instances(self):
+        event_without_instances = {
+            'detail': {
+                'requestParameters': {
+                    'instancesSet': {
+                        'items': []
+                    }
+                }
+            }
+        }
+        response = handler(event_without_instances, None)
+        self.assertEqual(response['statusCode'], 400)
+        self.assertEqual(response['body'], 'No instance IDs found')
+
+    @patch('boto3.client')
+    def test_start_instance_with_fallback_flexible_tag(self, mock_boto3_client):
+        # Mock EC2 instance
+        instance = {
+            'InstanceId': 'i-1234567890abcdef0',
+            'InstanceType': 't3.micro',
+            'Tags': [{'Key': 'Flexible', 'Value': 'true'}],
+            'Placement': {'AvailabilityZone': 'eu-central-1a'}
+        }
+
         # Create instance manager and test
-        manager = EC2InstanceManager()
-        manager.get_instance_details = MagicMock(return_value={
-            'instance_type': 't3.micro',
-            'instance_type_info': {'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}},
-            'vcpu': 2,
-            'memory_mib': 1024,
-            'ondemand_price': 0.0104
-        })
-        
-        result = manager.start_instance_with_fallback('i-1234567890abcdef0')
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        manager.get_instance_details = Mock()
+
+        result = manager.start_instance_with_fallback('i-1234567890abcdef0', instance)
         self.assertTrue(result)
-        mock_instance.start.assert_called_once()
-
-    @patch('boto3.resource')
-    def test_start_instance_with_fallback_no_flexible_tag(self, mock_boto3_resource):
-        # Create mock instance without flexible tag
-        mock_instance = MagicMock()
-        mock_instance.tags = [{'Key': 'other', 'Value': 'value'}]
-        
-        # Mock EC2 resource
-        mock_ec2_resource = MagicMock()
-        mock_ec2_resource.Instance.return_value = mock_instance
-        mock_boto3_resource.return_value = mock_ec2_resource
-        
+        mock_boto3_client.return_value.create_tags.assert_called_once_with(
+            Resources=['i-1234567890abcdef0'],
+            Tags=[{'Key': 'OriginalType', 'Value': 't3.micro'}]
+        )
+        mock_boto3_client.return_value.start_instances.assert_called_once_with(InstanceIds=['i-1234567890abcdef0'])
+        # Type specifications are only needed after an InsufficientInstanceCapacity error
+        manager.get_instance_details.assert_not_called()
+
+    @patch('boto3.client')
+    def test_start_instance_with_fallback_no_flexible_tag(self, mock_boto3_client):
+        # EC2 instance without flexible tag, passed in as the handler does
+        instance = {
+            'InstanceId': 'i-1234567890abcdef0',
+            'InstanceType': 't3.micro',
+            'Tags': [{'Key': 'other', 'Value': 'value'}]
+        }
+
         # Create instance manager and test
-        manager = EC2InstanceManager()
-        result = manager.start_instance_with_fallback('i-1234567890abcdef0')
-        
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        result = manager.start_instance_with_fallback('i-1234567890abcdef0', instance)
+
         self.assertFalse(result)
-        mock_instance.start.assert_not_called()
-
-    @patch('boto3.resource')
-    @patch.object(EC2InstanceManager, 'get_compatible_instance_types')
-    def test_get_compatible_instance_types(self, mock_get_compatible, mock_boto3_resource):
-        # Mock DynamoDB table
-        mock_table = MagicMock()
-        mock_boto3_resource.return_value.Table.return_value = mock_table
-        
-        # Setup mock return value
-        mock_get_compatible.return_value = ['t2.large', 't3a.large']
-        
-        # Create an instance of EC2InstanceManager
-        manager = EC2InstanceManager()
-        
-        # Call the method with some test parameters
-        alternatives = manager.get_compatible_instance_types(2, 8192, {'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}}, 't3.large')
-        
-        # Verify the result
-        self.assertTrue('t2.large' in alternatives)
-        self.assertTrue('t3a.large' in alternatives)
+        # The tag check returns before any EC2 call
+        self.assertEqual(mock_boto3_client.return_value.method_calls, [])
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', True)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types(self, mock_boto3_client):
+        prices = {
+            'm5.large': 0.096,
+            'm6i.large': 0.096,
+            'm7i-flex.large': 0.081,
+            'c5.xlarge': 0.17,
+            'c6i.xlarge': 0.17,
+            'm5a.large': 0.086,
+            'm6a.large': 0.0864,
+            'r5.large': 0.126
+        }
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': instance_type} for instance_type in prices]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+        # c5.xlarge is not offered in the instance's zone
+        mock_boto3_client.return_value.get_paginator.return_value.paginate.return_value = [
+            {'InstanceTypeOfferings': [{'InstanceType': instance_type} for instance_type in prices if instance_type != 'c5.xlarge']}
+        ]
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._region_price_maps, {'eu-central-1': prices}):
+            alternatives = manager.get_compatible_instance_types({
+                'instance_type': 'm5.large',
+                'instance_type_info': {'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}},
+                'tags': [],
+                'vcpu': 2,
+                'memory_mib': 8192
+            }, 'eu-central-1a', max_candidates=4)
+
+        # The cheapest offered candidates first, without the original type or flex types
+        # for a non-flex, non-burstable original
+        self.assertEqual(alternatives, ['m5a.large', 'm6a.large', 'm6i.large', 'r5.large'])
+        mock_boto3_client.return_value.get_products.assert_not_called()
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', False)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_single_call(self, mock_boto3_client):
+        def instance_type_info(instance_type, vcpu, memory_mib):
+            return {
+                'InstanceType': instance_type,
+                'VCpuInfo': {'DefaultVCpus': vcpu},
+                'MemoryInfo': {'SizeInMiB': memory_mib},
+                'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}
+            }
+
+        catalog = {
+            'm5.large': instance_type_info('m5.large', 2, 8192),
+            'm6i.large': instance_type_info('m6i.large', 2, 8192),
+            'm5.xlarge': instance_type_info('m5.xlarge', 4, 16384)
+        }
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': instance_type} for instance_type in catalog]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            alternatives = [
+                manager.get_compatible_instance_types({
+                    'instance_type': instance_type,
+                    'instance_type_info': catalog[instance_type],
+                    'tags': [],
+                    'vcpu': 2,
+                    'memory_mib': 8192
+                })
+                for instance_type in ('m5.large', 'm6i.large')
+            ]
+
+        # Candidates are sorted by size and never include the original type
+        self.assertEqual(alternatives, [['m6i.large', 'm5.xlarge'], ['m5.large', 'm5.xlarge']])
+        # Instances of the same size share one instance requirements lookup
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.assert_called_once()
+        mock_boto3_client.return_value.describe_instance_types.assert_not_called()
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', False)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_requirement_matches_expire(self, mock_boto3_client):
+        catalog = {
+            instance_type: {
+                'InstanceType': instance_type,
+                'VCpuInfo': {'DefaultVCpus': 2},
+                'MemoryInfo': {'SizeInMiB': 8192},
+                'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}
+            }
+            for instance_type in ('m5.large', 'm6i.large', 'm7i.large')
+        }
+        mock_lookup = mock_boto3_client.return_value.get_instance_types_from_instance_requirements
+        mock_lookup.side_effect = [
+            {'InstanceTypes': [{'InstanceType': 'm5.large'}, {'InstanceType': 'm6i.large'}]},
+            # m7i.large was launched in the meantime
+            {'InstanceTypes': [{'InstanceType': instance_type} for instance_type in catalog]}
+        ]
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+        instance_details = {
+            'instance_type': 'm5.large',
+            'instance_type_info': catalog['m5.large'],
+            'tags': [],
+            'vcpu': 2,
+            'memory_mib': 8192
+        }
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            self.assertEqual(manager.get_compatible_instance_types(instance_details), ['m6i.large'])
+            self.assertEqual(manager.get_compatible_instance_types(instance_details), ['m6i.large'])
+
+            # Once CACHE_TTL_SECONDS have passed, the requirements are looked up again
+            expired = time.time() + ec2_instance_manager.CACHE_TTL_SECONDS + 1
+            with patch('ec2_instance_manager.time.time', return_value=expired):
+                self.assertEqual(manager.get_compatible_instance_types(instance_details), ['m6i.large', 'm7i.large'])
+
+        self.assertEqual(mock_lookup.call_count, 2)
+
+    @patch('ec2_instance_manager.INSTANCE_REQUIREMENT_MATCHES_MAX_ENTRIES', 2)
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', False)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_requirement_matches_bounded(self, mock_boto3_client):
+        catalog = {
+            f'm5.{size}xlarge': {
+                'InstanceType': f'm5.{size}xlarge',
+                'VCpuInfo': {'DefaultVCpus': 4 * size},
+                'MemoryInfo': {'SizeInMiB': 16384 * size},
+                'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}
+            }
+            for size in range(1, 4)
+        }
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': instance_type} for instance_type in catalog]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            for info in catalog.values():
+                manager.get_compatible_instance_types({
+                    'instance_type': info['InstanceType'],
+                    'instance_type_info': info,
+                    'tags': [],
+                    'vcpu': info['VCpuInfo']['DefaultVCpus'],
+                    'memory_mib': info['MemoryInfo']['SizeInMiB']
+                })
+
+        # Each size has its own requirements, the oldest entry was evicted
+        self.assertEqual(len(ec2_instance_manager._instance_requirement_matches), 2)
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', False)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_filters_zone_before_truncating(self, mock_boto3_client):
+        catalog = {
+            instance_type: {
+                'InstanceType': instance_type,
+                'VCpuInfo': {'DefaultVCpus': vcpu},
+                'MemoryInfo': {'SizeInMiB': memory_mib},
+                'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}
+            }
+            for instance_type, vcpu, memory_mib in (('m5.large', 2, 8192), ('m6i.large', 2, 8192), ('m5.xlarge', 4, 16384))
+        }
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': instance_type} for instance_type in catalog]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+        # The smallest candidate, m6i.large, is not offered in the zone
+        mock_boto3_client.return_value.get_paginator.return_value.paginate.return_value = [
+            {'InstanceTypeOfferings': [{'InstanceType': 'm5.xlarge'}]}
+        ]
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            alternatives = manager.get_compatible_instance_types({
+                'instance_type': 'm5.large',
+                'instance_type_info': catalog['m5.large'],
+                'tags': [],
+                'vcpu': 2,
+                'memory_mib': 8192
+            }, 'eu-central-1a', max_candidates=1)
+
+        self.assertEqual(alternatives, ['m5.xlarge'])
+
+    @patch.dict(ec2_instance_manager._flexible_configurations, clear=True)
+    @patch.dict(ec2_instance_manager._instance_requirement_matches, clear=True)
+    @patch('ec2_instance_manager.SORT_BY_PRICE', False)
+    @patch('boto3.client')
+    def test_get_compatible_instance_types_max_candidates(self, mock_boto3_client):
+        catalog = {
+            f'm5.{size}xlarge': {
+                'InstanceType': f'm5.{size}xlarge',
+                'VCpuInfo': {'DefaultVCpus': 4 * size},
+                'MemoryInfo': {'SizeInMiB': 16384 * size},
+                'ProcessorInfo': {'SupportedArchitectures': ['x86_64']}
+            }
+            for size in range(1, 13)
+        }
+        mock_boto3_client.return_value.get_instance_types_from_instance_requirements.return_value = {
+            'InstanceTypes': [{'InstanceType': instance_type} for instance_type in catalog]
+        }
+        mock_boto3_client.return_value.get_parameter.return_value = {'Parameter': {'Value': '{}'}}
+        instance_details = {
+            'instance_type': 'm5.1xlarge',
+            'instance_type_info': catalog['m5.1xlarge'],
+            'tags': [],
+            'vcpu': 4,
+            'memory_mib': 16384
+        }
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with patch.dict(ec2_instance_manager._instance_type_catalogs, {'eu-central-1': catalog}):
+            candidates = manager.get_compatible_instance_types(instance_details)
+            all_types = manager.get_compatible_instance_types(instance_details, max_candidates=None)
+
+        self.assertEqual(candidates, [f'm5.{size}xlarge' for size in range(2, 12)])
+        self.assertEqual(all_types, [f'm5.{size}xlarge' for size in range(2, 13)])
+
+    @patch('instance_recovery.MAX_START_WORKERS', 1)
+    @patch('boto3.client')
+    def test_handler_deadline_waits_for_running_starts(self, mock_boto3_client):
+        def slow_start(instance_id, instance):
+            time.sleep(0.3)
+            return True
+
+        # Deadline 0.1s after the handler starts
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = (instance_recovery.TIMEOUT_MARGIN_SECONDS + 0.1) * 1000
+
+        with patch.object(EC2InstanceManager, 'start_instance_with_fallback', side_effect=slow_start) as mock_start_instance:
+            response = handler(self.event, context)
+
+        # The running start completes, the queued one is never attempted
+        results = json.loads(response['body'])['results']
+        self.assertEqual(results[0], {'instanceId': 'i-1234567890abcdef0', 'status': 'started', 'action': 'restart'})
+        self.assertEqual(results[1]['remaining_instances'], 1)
+        mock_start_instance.assert_called_once()
+
+        # The unattempted instance has its dedup entry released
+        mock_boto3_client.return_value.delete_item.assert_called_once_with(
+            TableName=instance_recovery.dedup_table_name,
+            Key={'dedupKey': {'S': 'i-0987654321fedcba0'}}
+        )
+        self.assertNotIn('i-0987654321fedcba0', instance_recovery._local_dedup)
+        self.assertIn('i-1234567890abcdef0', instance_recovery._local_dedup)
+
+        # so a retried event starts it
+        with patch.object(EC2InstanceManager, 'start_instance_with_fallback', return_value=True) as mock_start_instance:
+            response = handler(self.event, None)
+
+        results = json.loads(response['body'])['results']
+        self.assertEqual(results, [{'instanceId': 'i-0987654321fedcba0', 'status': 'started', 'action': 'restart'}])
+        mock_start_instance.assert_called_once()
+
+    @patch('instance_recovery.IN_FLIGHT_GRACE_SECONDS', 0.1)
+    @patch('instance_recovery.MAX_START_WORKERS', 1)
+    @patch('boto3.client')
+    def test_handler_deadline_reports_unfinished_starts_as_pending(self, mock_boto3_client):
+        release = threading.Event()
+        def blocked_start(instance_id, instance):
+            release.wait(5)
+            return True
+
+        # Deadline 0.1s after the handler starts
+        context = Mock()
+        context.get_remaining_time_in_millis.return_value = (instance_recovery.TIMEOUT_MARGIN_SECONDS + 0.1) * 1000
+
+        try:
+            with patch.object(EC2InstanceManager, 'start_instance_with_fallback', side_effect=blocked_start):
+                response = handler(self.event, context)
+        finally:
+            release.set()
+
+        # The handler returns without waiting for the start beyond the grace period
+        results = json.loads(response['body'])['results']
+        self.assertEqual(results[0], {'instanceId': 'i-1234567890abcdef0', 'status': 'pending'})
+        self.assertEqual(results[1]['remaining_instances'], 1)
+        # The start may still succeed, so its dedup entry is kept
+        self.assertIn('i-1234567890abcdef0', instance_recovery._local_dedup)
+        self.assertNotIn('i-0987654321fedcba0', instance_recovery._local_dedup)
+
+    @patch('ec2_instance_manager._disk_cache_put')
+    @patch('ec2_instance_manager._disk_cache_get', return_value=None)
+    @patch.dict(ec2_instance_manager._instance_type_catalogs, clear=True)
+    @patch('boto3.client')
+    def test_instance_type_catalog_loaded_once_by_concurrent_callers(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        def paginate():
+            time.sleep(0.05)
+            return [{'InstanceTypes': [{'InstanceType': 'm5.large'}]}]
+        mock_paginate = mock_boto3_client.return_value.get_paginator.return_value.paginate
+        mock_paginate.side_effect = paginate
+
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            catalogs = list(executor.map(lambda _: manager.load_instance_type_catalog(), range(4)))
+
+        self.assertEqual(catalogs, [{'m5.large': {'InstanceType': 'm5.large'}}] * 4)
+        mock_paginate.assert_called_once()
+        mock_disk_cache_put.assert_called_once()
+
+    @patch('ec2_instance_manager._disk_cache_put')
+    @patch('ec2_instance_manager._disk_cache_get', return_value=None)
+    @patch.dict(ec2_instance_manager._region_price_maps, {'eu-central-1': {}})
+    @patch('boto3.client')
+    def test_concurrent_price_lookups_share_the_pricing_limit(self, mock_boto3_client, mock_disk_cache_get, mock_disk_cache_put):
+        ec2_instance_manager.get_pricing_client.cache_clear()
+        ec2_instance_manager._get_ondemand_price_cached.cache_clear()
+        self.addCleanup(ec2_instance_manager._get_ondemand_price_cached.cache_clear)
+
+        lock = threading.Lock()
+        in_flight = []
+        max_in_flight = []
+
+        def get_products(**kwargs):
+            with lock:
+                in_flight.append(1)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+            return {'PriceList': [json.dumps({'terms': {'OnDemand': {'t': {'priceDimensions': {'d': {'pricePerUnit': {'USD': '0.1'}}}}}}})]}
+        mock_boto3_client.return_value.get_products.side_effect = get_products
+
+        # Three start workers pricing their candidates at the same time
+        manager = EC2InstanceManager('eu-central-1', instance_recovery.config_path)
+        instance_types = [[f'm{generation}.{size}' for size in range(10)] for generation in range(3)]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            prices = list(executor.map(manager.get_ondemand_prices, instance_types))
+
+        self.assertEqual(sum(len(price_map) for price_map in prices), 30)
+        self.assertLessEqual(max(max_in_flight), ec2_instance_manager.PRICING_MAX_WORKERS)
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
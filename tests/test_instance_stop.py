@@ -1,87 +1,68 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
+from botocore.exceptions import ClientError
 import json
-import sys
-import os
 
-# Add the lambda-stop directory to the Python path
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda-stop'))
+from instance_stop import handler, EC2InstanceManager, _get_ec2_client, _is_valid_instance_type
 
-from instance_stop import handler, EC2InstanceManager
+# State-change event shared by the tests, which never modify it
+_EVENT_STOP = {
+    'detail': {
+        'instance-id': 'i-1234567890abcdef0',
+        'state': 'stopped'
+    }
+}
 
 class TestInstanceStop(unittest.TestCase):
     def setUp(self):
-        self.event = {
-            'detail': {
-                'requestParameters': {
-                    'instancesSet': {
-                        'items': [
-                            {'instanceId': 'i-1234567890abcdef0'},
-                            {'instanceId': 'i-0987654321fedcba0'}
-                        ]
-                    }
-                }
-            }
+        # Clients are cached at module level; drop them so each test gets its own mocks
+        _get_ec2_client.cache_clear()
+        _is_valid_instance_type.cache_clear()
+
+        self.event = _EVENT_STOP
+
+    def mock_instance(self, mock_boto3_client, instance_type, tags):
+        mock_boto3_client.return_value.describe_instances.return_value = {
+            'Reservations': [{'Instances': [{'InstanceType': instance_type, 'Tags': tags}]}]
         }
 
     def test_handler_no_instances(self):
         event_without_instances = {
             'detail': {
-                'requestParameters': {
-                    'instancesSet': {
-                        'items': []
-                    }
-                }
+                'state': 'stopped'
             }
         }
         response = handler(event_without_instances, None)
         self.assertEqual(response['statusCode'], 400)
-        self.assertEqual(response['body'], 'No instance IDs found')
+        self.assertEqual(response['body'], 'No instance ID found')
 
-    @patch('boto3.resource')
     @patch('boto3.client')
-    def test_reset_instance_type_not_flexible(self, mock_boto3_client, mock_boto3_resource):
+    def test_reset_instance_type_not_flexible(self, mock_boto3_client):
         # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [{'Key': 'Flexible', 'Value': 'false'}]
-        mock_instance.instance_type = 't3.large'
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
+        self.mock_instance(mock_boto3_client, 't3.large', [{'Key': 'Flexible', 'Value': 'false'}])
 
         manager = EC2InstanceManager()
         result = manager.reset_instance_type('i-1234567890abcdef0')
         
         self.assertIsNone(result)
 
-    @patch('boto3.resource')
     @patch('boto3.client')
-    def test_reset_instance_type_flexible_no_original(self, mock_boto3_client, mock_boto3_resource):
+    def test_reset_instance_type_flexible_no_original(self, mock_boto3_client):
         # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [{'Key': 'Flexible', 'Value': 'true'}]
-        mock_instance.instance_type = 't3.large'
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
+        self.mock_instance(mock_boto3_client, 't3.large', [{'Key': 'Flexible', 'Value': 'true'}])
 
         manager = EC2InstanceManager()
         result = manager.reset_instance_type('i-1234567890abcdef0')
         
         self.assertIsNone(result)
 
-    @patch('boto3.resource')
     @patch('boto3.client')
-    def test_reset_instance_type_successful(self, mock_boto3_client, mock_boto3_resource):
+    def test_reset_instance_type_successful(self, mock_boto3_client):
         # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [
+        self.mock_instance(mock_boto3_client, 't3.large', [
             {'Key': 'Flexible', 'Value': 'true'},
             {'Key': 'OriginalType', 'Value': 't3.medium'}
-        ]
-        mock_instance.instance_type = 't3.large'
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
-
-        # Mock instance type validation
-        mock_boto3_client.return_value.describe_instance_types.return_value = {
-            'InstanceTypes': [{'InstanceType': 't3.medium'}]
-        }
+        ])
 
         manager = EC2InstanceManager()
         with patch.object(manager, 'wait_for_instance_stopped', return_value=(True, 'stopped')):
@@ -91,28 +72,41 @@ class TestInstanceStop(unittest.TestCase):
         self.assertEqual(result['instance_id'], 'i-1234567890abcdef0')
         self.assertEqual(result['instance_type'], 't3.large')
         self.assertEqual(result['new_instance_type'], 't3.medium')
-        mock_instance.modify_attribute.assert_called_once_with(
+        mock_boto3_client.return_value.modify_instance_attribute.assert_called_once_with(
+            InstanceId='i-1234567890abcdef0',
             InstanceType={'Value': 't3.medium'}
         )
-        mock_instance.delete_tags.assert_called_once_with(
+        mock_boto3_client.return_value.delete_tags.assert_called_once_with(
+            Resources=['i-1234567890abcdef0'],
             Tags=[{'Key': 'OriginalType'}]
         )
 
-    @patch('boto3.resource')
     @patch('boto3.client')
-    def test_reset_instance_type_invalid_type(self, mock_boto3_client, mock_boto3_resource):
+    def test_reset_instance_type_skips_validation_by_default(self, mock_boto3_client):
         # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [
+        self.mock_instance(mock_boto3_client, 't3.medium', [
+            {'Key': 'Flexible', 'Value': 'true'},
+            {'Key': 'OriginalType', 'Value': 't3.medium'}
+        ])
+
+        manager = EC2InstanceManager()
+        result = manager.reset_instance_type('i-1234567890abcdef0')
+
+        self.assertEqual(result['new_instance_type'], 't3.medium')
+        mock_boto3_client.return_value.describe_instance_types.assert_not_called()
+
+    @patch('instance_stop.validate_original_type', True)
+    @patch('boto3.client')
+    def test_reset_instance_type_invalid_type(self, mock_boto3_client):
+        # Mock EC2 instance
+        self.mock_instance(mock_boto3_client, 't3.large', [
             {'Key': 'Flexible', 'Value': 'true'},
             {'Key': 'OriginalType', 'Value': 'invalid.type'}
-        ]
-        mock_instance.instance_type = 't3.large'
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
+        ])
 
         # Mock instance type validation failure
         mock_boto3_client.return_value.describe_instance_types.side_effect = \
-            mock_boto3_resource.return_value.meta.client.exceptions.ClientError(
+            ClientError(
                 {'Error': {'Code': 'InvalidInstanceType', 'Message': 'Invalid instance type'}},
                 'DescribeInstanceTypes'
             )
@@ -122,13 +116,31 @@ class TestInstanceStop(unittest.TestCase):
         
         self.assertIsNone(result)
 
-    @patch('boto3.resource')
     @patch('boto3.client')
-    def test_wait_for_instance_stopped_success(self, mock_boto3_client, mock_boto3_resource):
-        # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.state = {'Name': 'stopped'}
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
+    def test_is_valid_instance_type_describes_once(self, mock_boto3_client):
+        mock_boto3_client.return_value.describe_instance_types.return_value = {
+            'InstanceTypes': [{'InstanceType': 't3.medium'}]
+        }
+
+        manager = EC2InstanceManager()
+        self.assertTrue(manager._is_valid_instance_type('t3.medium'))
+        self.assertTrue(EC2InstanceManager()._is_valid_instance_type('t3.medium'))
+
+        mock_boto3_client.return_value.describe_instance_types.assert_called_once_with(
+            InstanceTypes=['t3.medium']
+        )
+
+    @patch('instance_stop.region', 'eu-central-1')
+    def test_client_keeps_connections_alive(self):
+        self.assertTrue(_get_ec2_client().meta.config.tcp_keepalive)
+
+    @patch('instance_stop.time.sleep')
+    @patch('boto3.client')
+    def test_wait_for_instance_stopped_success(self, mock_boto3_client, mock_sleep):
+        # Mock EC2 instance status
+        mock_boto3_client.return_value.describe_instance_status.return_value = {
+            'InstanceStatuses': [{'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'stopped'}}]
+        }
 
         manager = EC2InstanceManager()
         success, state = manager.wait_for_instance_stopped('i-1234567890abcdef0')
@@ -136,13 +148,13 @@ class TestInstanceStop(unittest.TestCase):
         self.assertTrue(success)
         self.assertEqual(state, 'stopped')
 
-    @patch('boto3.resource')
+    @patch('instance_stop.time.sleep')
     @patch('boto3.client')
-    def test_wait_for_instance_stopped_terminated(self, mock_boto3_client, mock_boto3_resource):
-        # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.state = {'Name': 'terminated'}
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
+    def test_wait_for_instance_stopped_terminated(self, mock_boto3_client, mock_sleep):
+        # Mock EC2 instance status
+        mock_boto3_client.return_value.describe_instance_status.return_value = {
+            'InstanceStatuses': [{'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'terminated'}}]
+        }
 
         manager = EC2InstanceManager()
         success, state = manager.wait_for_instance_stopped('i-1234567890abcdef0')
@@ -150,32 +162,91 @@ class TestInstanceStop(unittest.TestCase):
         self.assertFalse(success)
         self.assertEqual(state, 'terminated')
 
-    @patch('boto3.resource')
+    @patch('instance_stop.time.sleep')
     @patch('boto3.client')
-    def test_handler_successful_reset(self, mock_boto3_client, mock_boto3_resource):
-        # Mock EC2 instance
-        mock_instance = MagicMock()
-        mock_instance.tags = [
-            {'Key': 'Flexible', 'Value': 'true'},
-            {'Key': 'OriginalType', 'Value': 't3.medium'}
+    def test_wait_for_instance_stopped_polls_while_stopping(self, mock_boto3_client, mock_sleep):
+        # Mock EC2 instance status, stopping on the first check
+        mock_boto3_client.return_value.describe_instance_status.side_effect = [
+            {'InstanceStatuses': [{'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'stopping'}}]},
+            {'InstanceStatuses': [{'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'stopped'}}]}
         ]
-        mock_instance.instance_type = 't3.large'
-        mock_boto3_resource.return_value.Instance.return_value = mock_instance
 
-        # Mock instance type validation
-        mock_boto3_client.return_value.describe_instance_types.return_value = {
-            'InstanceTypes': [{'InstanceType': 't3.medium'}]
+        manager = EC2InstanceManager()
+        success, state = manager.wait_for_instance_stopped('i-1234567890abcdef0')
+
+        self.assertTrue(success)
+        self.assertEqual(state, 'stopped')
+        mock_sleep.assert_called_once()
+
+    @patch('instance_stop.time.sleep')
+    @patch('boto3.client')
+    def test_wait_for_instance_stopped_timeout(self, mock_boto3_client, mock_sleep):
+        # Mock EC2 instance status that never leaves stopping
+        mock_boto3_client.return_value.describe_instance_status.return_value = {
+            'InstanceStatuses': [{'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'stopping'}}]
+        }
+
+        manager = EC2InstanceManager()
+        success, state = manager.wait_for_instance_stopped('i-1234567890abcdef0', max_attempts=3)
+
+        self.assertFalse(success)
+        self.assertEqual(state, 'stopping')
+        # No sleep after the last attempt
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(mock_boto3_client.return_value.describe_instance_status.call_count, 3)
+
+    @patch('boto3.client')
+    def test_get_instance_states_single_call(self, mock_boto3_client):
+        mock_boto3_client.return_value.describe_instance_status.return_value = {
+            'InstanceStatuses': [
+                {'InstanceId': 'i-1234567890abcdef0', 'InstanceState': {'Name': 'stopped'}},
+                {'InstanceId': 'i-0987654321fedcba0', 'InstanceState': {'Name': 'stopping'}}
+            ]
         }
 
+        manager = EC2InstanceManager()
+        states = manager.get_instance_states(['i-1234567890abcdef0', 'i-0987654321fedcba0'])
+
+        self.assertEqual(states, {'i-1234567890abcdef0': 'stopped', 'i-0987654321fedcba0': 'stopping'})
+        mock_boto3_client.return_value.describe_instance_status.assert_called_once_with(
+            InstanceIds=['i-1234567890abcdef0', 'i-0987654321fedcba0'],
+            IncludeAllInstances=True
+        )
+
+    @patch('boto3.client')
+    def test_handler_successful_reset(self, mock_boto3_client):
+        # Mock EC2 instance
+        self.mock_instance(mock_boto3_client, 't3.large', [
+            {'Key': 'Flexible', 'Value': 'true'},
+            {'Key': 'OriginalType', 'Value': 't3.medium'}
+        ])
+
         with patch.object(EC2InstanceManager, 'wait_for_instance_stopped', return_value=(True, 'stopped')):
             response = handler(self.event, None)
 
         self.assertEqual(response['statusCode'], 200)
         results = json.loads(response['body'])['results']
-        self.assertEqual(len(results), 2)
+        self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['instanceId'], 'i-1234567890abcdef0')
         self.assertEqual(results[0]['instanceType'], 't3.large')
         self.assertEqual(results[0]['newInstanceType'], 't3.medium')
 
+    @patch('boto3.client')
+    def test_handler_instance_error_reported(self, mock_boto3_client):
+        mock_boto3_client.return_value.describe_instances.side_effect = ClientError(
+            {'Error': {'Code': 'InvalidInstanceID.NotFound', 'Message': 'Instance not found'}},
+            'DescribeInstances'
+        )
+
+        response = handler(self.event, None)
+
+        # The error is reported for the instance instead of failing the event
+        self.assertEqual(response['statusCode'], 200)
+        results = json.loads(response['body'])['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['instanceId'], 'i-1234567890abcdef0')
+        self.assertEqual(results[0]['status'], 'failed')
+        mock_boto3_client.return_value.modify_instance_attribute.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import patch
+import json
+
+from price_catalog_refresh import handler
+from ec2_instance_manager import get_s3_client
+
+@patch('price_catalog_refresh.region', 'eu-central-1')
+@patch('price_catalog_refresh.price_catalog_bucket', 'price-catalog-bucket')
+class TestPriceCatalogRefresh(unittest.TestCase):
+    def setUp(self):
+        # The S3 client is cached at module level; drop it so each test gets its own mock
+        get_s3_client.cache_clear()
+
+    @patch('boto3.client')
+    @patch('price_catalog_refresh.fetch_region_price_map')
+    def test_handler_publishes_price_catalog(self, mock_fetch_region_price_map, mock_boto3_client):
+        mock_fetch_region_price_map.return_value = {'m5.large': 0.096, 'c5.large': 0.085}
+
+        response = handler({}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['instanceTypes'], 2)
+        mock_fetch_region_price_map.assert_called_once_with('eu-central-1')
+        mock_boto3_client.return_value.put_object.assert_called_once_with(
+            Bucket='price-catalog-bucket',
+            Key='eu-central-1.json',
+            Body=json.dumps({'m5.large': 0.096, 'c5.large': 0.085}),
+            ContentType='application/json'
+        )
+
+    @patch('boto3.client')
+    @patch('price_catalog_refresh.fetch_region_price_map')
+    def test_handler_keeps_catalog_without_prices(self, mock_fetch_region_price_map, mock_boto3_client):
+        mock_fetch_region_price_map.return_value = {}
+
+        response = handler({}, None)
+
+        # An empty result never overwrites the published catalog
+        self.assertEqual(response['statusCode'], 500)
+        mock_boto3_client.return_value.put_object.assert_not_called()
+
+    @patch('boto3.client')
+    @patch('price_catalog_refresh.fetch_region_price_map')
+    def test_handler_pricing_error(self, mock_fetch_region_price_map, mock_boto3_client):
+        mock_fetch_region_price_map.side_effect = Exception('Rate exceeded')
+
+        response = handler({}, None)
+
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(json.loads(response['body'])['error'], 'Rate exceeded')
+        mock_boto3_client.return_value.put_object.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,41 +3,98 @@
 import argparse
 import boto3
 import csv
+import glob
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from lambda_start.ec2_instance_manager import EC2InstanceManager
+from lambda_start.ec2_instance_manager import EC2InstanceManager, SORT_BY_PRICE, CACHE_DIR
 
-def generate_compatibility_csv(config_path):
+# Maximum number of instance types processed concurrently, matching the EC2 client's connection pool
+MAX_WORKERS = 10
+
+# Number of rows between progress messages
+PROGRESS_INTERVAL = 50
+
+def get_compatibility_row(manager, instance_type_info):
+    """
+    Compute the CSV row of an instance type and its compatible alternatives.
+    
+    Args:
+        manager (EC2InstanceManager): The manager used to find compatible types
+        instance_type_info (dict): The DescribeInstanceTypes entry of the instance type
+        
+    Returns:
+        list: The instance type and its comma separated compatible types, or the error
+    """
+    instance_type = instance_type_info['InstanceType']
+    try:
+        # Get instance details
+        instance_details = {
+            'instance_type': instance_type,
+            'instance_type_info': instance_type_info,
+            'tags': [],
+            'vcpu': instance_type_info['VCpuInfo']['DefaultVCpus'],
+            'memory_mib': instance_type_info['MemoryInfo']['SizeInMiB']
+        }
+        
+        # Get every compatible type, not just the candidates the Lambda function tries
+        compatible_types = manager.get_compatible_instance_types(instance_details, max_candidates=None)
+        return [instance_type, ', '.join(compatible_types)]
+        
+    except Exception as e:
+        print(f"Error processing {instance_type}: {e}")
+        return [instance_type, f"Error: {str(e)}"]
+
+def clear_region_cache(region):
+    """
+    Remove the instance type catalog and prices of a region from the on-disk cache.
+    
+    Args:
+        region (str): The region whose cache entries are removed
+    """
+    cache_files = [os.path.join(CACHE_DIR, f"{cache_key}.json") for cache_key in (f"instance-types-{region}", f"prices-{region}")]
+    # Prices looked up individually are cached per instance type
+    cache_files.extend(glob.glob(os.path.join(CACHE_DIR, f"price-{glob.escape(region)}-*.json")))
+    for cache_file in cache_files:
+        try:
+            os.remove(cache_file)
+        except FileNotFoundError:
+            pass
+
+def generate_compatibility_csv(config_path, refresh_cache=False):
     """
     Generate a CSV file listing all EC2 instance types and their compatible alternatives.
     
     Args:
         config_path (str): Path to the configuration file
+        refresh_cache (bool): Fetch instance types and prices again instead of reading them from the on-disk cache
     """
-    # Initialize EC2 client and EC2InstanceManager
+    # Resolve the region and initialize EC2InstanceManager
     current_region = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
     if not current_region:
-        ec2_client = boto3.client('ec2')
-        current_region = ec2_client.meta.region_name
-    else:
-        ec2_client = boto3.client('ec2', region_name=current_region)
+        current_region = boto3.session.Session().region_name
 
     print(f"Using region: {current_region}")
+    if refresh_cache:
+        clear_region_cache(current_region)
     manager = EC2InstanceManager(current_region, config_path)
     
-    # Get all available instance types
-    paginator = ec2_client.get_paginator('describe_instance_types')
-    all_instance_types = []
-    
+    # Get all available instance types from the manager's catalog, which also
+    # serves the instance type lookups made while computing compatible types
     print("Fetching all available instance types...")
-    for page in paginator.paginate():
-        for instance_type in page['InstanceTypes']:
-            all_instance_types.append(instance_type)
+    all_instance_types = list(manager.load_instance_type_catalog().values())
+    if not all_instance_types:
+        print(f"Error: Unable to fetch instance types for {current_region}")
+        sys.exit(1)
     
     # Sort instance types by name
     all_instance_types.sort(key=lambda x: x['InstanceType'])
+
+    # Load the region's prices once, before the workers look them up concurrently
+    if SORT_BY_PRICE:
+        manager.load_region_prices()
     
     # Prepare CSV output path
     config_dir = os.path.dirname(config_path)
@@ -46,46 +103,36 @@ def generate_compatibility_csv(config_path):
     
     # Create CSV file
     print(f"Generating compatibility matrix to {output_file}...")
-    with open(output_file, 'w', newline='') as csvfile:
+    with open(output_file, 'w', newline='', buffering=1 << 16) as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Instance Type', 'Compatible Instance Types'])
         
         total = len(all_instance_types)
-        for idx, instance_type_info in enumerate(all_instance_types, 1):
-            instance_type = instance_type_info['InstanceType']
-            print(f"Processing {instance_type} ({idx}/{total})...")
-            
-            try:
-                # Get instance details
-                instance_details = {
-                    'instance_type': instance_type,
-                    'instance_type_info': instance_type_info,
-                    'vcpu': instance_type_info['VCpuInfo']['DefaultVCpus'],
-                    'memory_mib': instance_type_info['MemoryInfo']['SizeInMiB']
-                }
-                
-                # Get compatible types
-                compatible_types = manager.get_compatible_instance_types(instance_details)
+        # Instance types are independent, so they are processed concurrently;
+        # map returns the rows in input order, keeping the CSV sorted by name
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            rows = executor.map(lambda info: get_compatibility_row(manager, info), all_instance_types)
+            for idx, row in enumerate(rows, 1):
+                if idx % PROGRESS_INTERVAL == 0 or idx == total:
+                    print(f"Processed {idx}/{total} instance types...")
                 
                 # Write to CSV
-                writer.writerow([instance_type, ', '.join(compatible_types)])
-                
-            except Exception as e:
-                print(f"Error processing {instance_type}: {e}")
-                writer.writerow([instance_type, f"Error: {str(e)}"])
+                writer.writerow(row)
     
     print(f"\nCompatibility matrix has been saved to: {output_file}")
 
 def main():
     parser = argparse.ArgumentParser(description='Generate EC2 instance type compatibility matrix')
     parser.add_argument('config_path', help='Path to the configuration file')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='Fetch instance types and prices again instead of using the on-disk cache')
     args = parser.parse_args()
     
     if not os.path.exists(args.config_path):
         print(f"Error: Configuration file not found at {args.config_path}")
         sys.exit(1)
         
-    generate_compatibility_csv(args.config_path)
+    generate_compatibility_csv(args.config_path, args.refresh_cache)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file